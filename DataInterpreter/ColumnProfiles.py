@@ -0,0 +1,117 @@
+import os
+
+from SqlTool import quote_identifier
+
+# Nombre de valeurs les plus fréquentes conservées par colonne
+PROFILE_TOP_VALUES = int(os.getenv("PROFILE_TOP_VALUES", 5))
+
+# Les valeurs fréquentes ne sont relevées que pour les colonnes catégorielles,
+# dont le nombre approximatif de valeurs distinctes ne dépasse pas ce seuil
+PROFILE_MAX_DISTINCT = int(os.getenv("PROFILE_MAX_DISTINCT", 1000))
+
+# Longueur maximale des valeurs (min, max, valeurs fréquentes) conservées
+PROFILE_VALUE_LENGTH = 50
+
+# Types imbriqués : ni min/max ni valeurs fréquentes
+NESTED_TYPE_MARKERS = ("[]", "STRUCT", "MAP", "UNION")
+
+
+def is_nested_type(column_type):
+    return any(marker in column_type.upper() for marker in NESTED_TYPE_MARKERS)
+
+
+def profile_table(conn, table_name):
+    """
+    Calcule le profil de chaque colonne d'une table avec des agrégats approchés :
+    part de valeurs nulles, nombre approximatif de valeurs distinctes, minimum,
+    maximum et valeurs les plus fréquentes des colonnes catégorielles. La table est
+    lue deux fois au plus, quel que soit son nombre de colonnes.
+    """
+    columns = conn.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_schema = 'main' AND table_name = ? ORDER BY ordinal_position",
+        [table_name],
+    ).fetchall()
+    if not columns:
+        return []
+
+    aggregates = ["count(*)"]
+    for column_name, column_type in columns:
+        column = quote_identifier(column_name)
+        aggregates += [f"count({column})", f"approx_count_distinct({column})"]
+        if is_nested_type(column_type):
+            aggregates += ["NULL", "NULL"]
+        else:
+            aggregates += [
+                f"left(CAST(min({column}) AS VARCHAR), {PROFILE_VALUE_LENGTH})",
+                f"left(CAST(max({column}) AS VARCHAR), {PROFILE_VALUE_LENGTH})",
+            ]
+    row = conn.execute(f"SELECT {', '.join(aggregates)} FROM {table_name}").fetchone()
+
+    row_count = row[0]
+    profiles = []
+    for index, (column_name, column_type) in enumerate(columns):
+        non_null, approx_distinct, min_value, max_value = row[1 + 4 * index : 5 + 4 * index]
+        profiles.append(
+            {
+                "column_name": column_name,
+                "column_type": column_type,
+                "null_ratio": (row_count - non_null) / row_count if row_count else 0.0,
+                "approx_distinct": approx_distinct,
+                "min_value": min_value,
+                "max_value": max_value,
+                "top_values": [],
+            }
+        )
+
+    categorical = [
+        profile
+        for profile in profiles
+        if 0 < profile["approx_distinct"] <= PROFILE_MAX_DISTINCT
+        and not is_nested_type(profile["column_type"])
+    ]
+    if categorical and PROFILE_TOP_VALUES > 0:
+        top_values = conn.execute(
+            "SELECT "
+            + ", ".join(
+                f"CAST(approx_top_k({quote_identifier(profile['column_name'])}, "
+                f"{PROFILE_TOP_VALUES}) AS VARCHAR[])"
+                for profile in categorical
+            )
+            + f" FROM {table_name}"
+        ).fetchone()
+        for profile, values in zip(categorical, top_values):
+            profile["top_values"] = [
+                value[:PROFILE_VALUE_LENGTH] for value in values or [] if value is not None
+            ]
+    return profiles
+
+
+def profile_tables(conn, table_names):
+    """
+    Profile plusieurs tables et retourne {table: [profil de colonne, ...]}. Une
+    table qui ne peut être profilée est ignorée sans interrompre l'ingestion.
+    """
+    profiles = {}
+    for table_name in table_names:
+        try:
+            profiles[table_name] = profile_table(conn, table_name)
+        except Exception as e:
+            print(f"Error profiling table '{table_name}': {e}")
+    return profiles
+
+
+def describe_profile(profile):
+    """Résumé compact d'un profil de colonne, ajouté à sa description pour les modèles."""
+    details = []
+    if profile["null_ratio"]:
+        details.append(f"{profile['null_ratio']:.0%} null")
+    if profile["approx_distinct"] is not None:
+        details.append(f"~{profile['approx_distinct']} distinct")
+    if profile["top_values"]:
+        details.append(
+            "values: " + ", ".join(f"'{value}'" for value in profile["top_values"])
+        )
+    elif profile["min_value"] is not None:
+        details.append(f"min '{profile['min_value']}', max '{profile['max_value']}'")
+    return "; ".join(details)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from SetupDatabase import SUPPORTED_EXTENSIONS
+
+# Délai sans nouvel événement avant de traiter un fichier (copie d'un gros fichier en plusieurs écritures)
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", 2.0))
+
+
+def is_supported_file(path):
+    return path.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def scan_data_files(directory):
+    """Parcourt récursivement un répertoire et retourne les fichiers pris en charge."""
+    return {
+        os.path.abspath(os.path.join(root, f))
+        for root, _, files in os.walk(directory)
+        for f in files
+        if is_supported_file(f)
+    }
+
+
+class DataDirectoryHandler(FileSystemEventHandler):
+    """
+    Note pour chaque fichier la dernière opération demandée (« ingest » ou
+    « remove ») et la date de son dernier événement.
+    """
+
+    def __init__(self, known_files):
+        self.known_files = set(known_files)
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def mark(self, path, action):
+        path = os.path.abspath(path)
+        if not is_supported_file(path):
+            return
+        with self.lock:
+            self.pending[path] = (action, time.monotonic())
+            if action == "remove":
+                self.known_files.discard(path)
+            else:
+                self.known_files.add(path)
+
+    def mark_directory(self, directory, action):
+        """Un répertoire ajouté ou retiré d'un bloc n'émet pas d'événement par fichier."""
+        if action == "ingest":
+            paths = scan_data_files(directory)
+        else:
+            prefix = os.path.join(os.path.abspath(directory), "")
+            with self.lock:
+                paths = {path for path in self.known_files if path.startswith(prefix)}
+        for path in paths:
+            self.mark(path, action)
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.mark_directory(event.src_path, "ingest")
+        else:
+            self.mark(event.src_path, "ingest")
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.mark(event.src_path, "ingest")
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.mark(event.src_path, "ingest")
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.mark_directory(event.src_path, "remove")
+        else:
+            self.mark(event.src_path, "remove")
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.mark_directory(event.src_path, "remove")
+            self.mark_directory(event.dest_path, "ingest")
+        else:
+            self.mark(event.src_path, "remove")
+            self.mark(event.dest_path, "ingest")
+
+    def pop_settled(self, debounce_seconds):
+        """Retire et retourne les opérations sans nouvel événement depuis `debounce_seconds`."""
+        now = time.monotonic()
+        with self.lock:
+            settled = [
+                (path, action)
+                for path, (action, last_event) in self.pending.items()
+                if now - last_event >= debounce_seconds
+            ]
+            for path, _ in settled:
+                del self.pending[path]
+        return settled
+
+
+class DataWatcher:
+    """
+    Surveille récursivement le répertoire de données et transmet chaque fichier
+    ajouté, modifié ou supprimé à `on_change(path, action)`, une fois ses
+    événements retombés pendant `debounce_seconds`.
+    """
+
+    def __init__(self, directory, on_change, known_files=(), debounce_seconds=WATCH_DEBOUNCE_SECONDS):
+        self.directory = directory
+        self.on_change = on_change
+        self.debounce_seconds = debounce_seconds
+        self.handler = DataDirectoryHandler(known_files)
+        self.observer = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.observer = Observer()
+        self.observer.schedule(self.handler, self.directory, recursive=True)
+        self.observer.start()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._dispatch, name="data-watcher", daemon=True
+        )
+        self._thread.start()
+        print(f"Watching {self.directory} for changes.")
+
+    def stop(self):
+        self._stop_event.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _dispatch(self):
+        while not self._stop_event.wait(min(0.5, self.debounce_seconds)):
+            for path, action in self.handler.pop_settled(self.debounce_seconds):
+                print(f"Change detected: {action} {path}")
+                try:
+                    self.on_change(path, action)
+                except Exception as e:
+                    print(f"Error handling change of {path}: {e}")
@@ -0,0 +1,179 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import duckdb
+
+# Base DuckDB partagée par l'ingestion et les requêtes
+DATABASE_PATH = os.getenv("DATABASE_PATH", "/app/db/my_database.duckdb")
+
+# Un processus qui ne fait que des requêtes peut ouvrir la base en lecture seule.
+# DuckDB n'accepte qu'une configuration par fichier et par processus : un processus
+# qui ingère aussi des fichiers doit garder la base en lecture-écriture.
+DUCKDB_READ_ONLY = os.getenv("DUCKDB_READ_ONLY", "false").lower() in ("1", "true", "yes")
+
+# Paramètres globaux de la base (vides : valeurs par défaut de DuckDB)
+DUCKDB_THREADS = os.getenv("DUCKDB_THREADS") or None
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT") or None
+
+# Nombre maximal de curseurs inactifs conservés dans le pool
+DUCKDB_POOL_SIZE = int(os.getenv("DUCKDB_POOL_SIZE", 8))
+
+
+class ConnectionManager:
+    """
+    Ouvre une seule fois la base DuckDB et distribue des curseurs sur cette
+    connexion : le catalogue n'est chargé qu'une fois et les requêtes concurrentes
+    partagent la même instance au lieu de se disputer le verrou du fichier.
+    Un curseur DuckDB ne doit être utilisé que par un thread à la fois.
+    """
+
+    def __init__(
+        self,
+        database_path=DATABASE_PATH,
+        read_only=DUCKDB_READ_ONLY,
+        threads=DUCKDB_THREADS,
+        memory_limit=DUCKDB_MEMORY_LIMIT,
+        pool_size=DUCKDB_POOL_SIZE,
+    ):
+        self.database_path = database_path
+        self.read_only = read_only
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.pool_size = pool_size
+        self._connection = None
+        self._generation = 0
+        self._idle_cursors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Retourne la connexion racine, ouverte au premier appel."""
+        with self._lock:
+            if self._connection is None:
+                if not self.read_only:
+                    os.makedirs(os.path.dirname(self.database_path) or ".", exist_ok=True)
+                connection = duckdb.connect(self.database_path, read_only=self.read_only)
+                # Appliqués par SET et non via `config` pour qu'une connexion ouverte
+                # ailleurs avec duckdb.connect() sur le même fichier reste compatible
+                if self.threads:
+                    connection.execute(f"SET threads = {int(self.threads)}")
+                if self.memory_limit:
+                    connection.execute(f"SET memory_limit = '{self.memory_limit}'")
+                self._connection = connection
+                self._generation += 1
+                print(
+                    f"Opened DuckDB database {self.database_path} "
+                    f"(read_only={self.read_only}, threads={self.threads}, "
+                    f"memory_limit={self.memory_limit})."
+                )
+            return self._connection
+
+    def connect(self):
+        """Retourne un nouveau curseur sur la base partagée, à fermer par l'appelant."""
+        return self.connection().cursor()
+
+    def thread_cursor(self):
+        """Retourne le curseur propre au thread appelant, créé à sa première utilisation."""
+        connection = self.connection()
+        cached = getattr(self._local, "cursor", None)
+        if cached is None or cached[0] != self._generation:
+            cached = (self._generation, connection.cursor())
+            self._local.cursor = cached
+        return cached[1]
+
+    @contextmanager
+    def pooled_cursor(self):
+        """Emprunte un curseur au pool et le lui rend à la sortie du bloc `with`."""
+        connection = self.connection()
+        with self._lock:
+            generation = self._generation
+            cursor = self._idle_cursors.pop() if self._idle_cursors else None
+        if cursor is None:
+            cursor = connection.cursor()
+        try:
+            yield cursor
+        finally:
+            with self._lock:
+                keep = (
+                    generation == self._generation
+                    and len(self._idle_cursors) < self.pool_size
+                )
+                if keep:
+                    self._idle_cursors.append(cursor)
+            if not keep:
+                cursor.close()
+
+    def close(self):
+        """Ferme la connexion racine et, avec elle, tous les curseurs distribués."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._idle_cursors = []
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+# Version de la base, incrémentée à chaque modification publiée par l'ingestion,
+# et version à laquelle chaque table a été modifiée pour la dernière fois
+_version_lock = threading.Lock()
+_database_version = 0
+_table_versions = {}
+# Version à partir de laquelle toutes les tables sont considérées comme modifiées
+_reset_version = 0
+
+
+def get_connection_manager():
+    """Retourne le gestionnaire de connexions du processus."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ConnectionManager()
+        return _manager
+
+
+def connect_database():
+    return get_connection_manager().connect()
+
+
+def thread_cursor():
+    return get_connection_manager().thread_cursor()
+
+
+def pooled_cursor():
+    return get_connection_manager().pooled_cursor()
+
+
+def close_database():
+    get_connection_manager().close()
+
+
+def database_version():
+    """Retourne la version courante de la base."""
+    with _version_lock:
+        return _database_version
+
+
+def table_version(table_name):
+    """Retourne la version à laquelle une table a été créée, remplacée ou supprimée."""
+    with _version_lock:
+        return max(_table_versions.get(table_name.lower(), 0), _reset_version)
+
+
+def bump_database_version(tables=None):
+    """
+    Incrémente la version de la base après une modification validée. Sans liste
+    de tables, toutes les tables sont considérées comme modifiées.
+    """
+    global _database_version, _reset_version
+    with _version_lock:
+        _database_version += 1
+        if tables is None:
+            _reset_version = _database_version
+            _table_versions.clear()
+        else:
+            for table_name in tables:
+                _table_versions[table_name.lower()] = _database_version
+        return _database_version
@@ -0,0 +1,279 @@
+import hashlib
+import os
+from datetime import datetime
+
+# Schéma interne : ses tables n'apparaissent pas dans SHOW TABLES ni dans le schéma envoyé aux modèles
+CATALOG_SCHEMA = "_catalog"
+MANIFEST_TABLE = f"{CATALOG_SCHEMA}.ingestion_manifest"
+# Une ligne par table publiée : fichier source, nombre de lignes et date d'ingestion
+LINEAGE_TABLE = f"{CATALOG_SCHEMA}.table_lineage"
+# Une ligne par colonne de table publiée : statistiques calculées à l'ingestion (voir ColumnProfiles)
+PROFILE_TABLE = f"{CATALOG_SCHEMA}.column_profiles"
+
+# Préfixe des tables en cours de construction, échangées avec les tables définitives une fois prêtes
+SHADOW_PREFIX = "__shadow_"
+
+# Taille des blocs lus pour calculer l'empreinte d'un fichier
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def ensure_manifest_table(conn):
+    """Crée le manifeste d'ingestion et les catalogues de lignage et de profils s'ils n'existent pas encore."""
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {CATALOG_SCHEMA}")
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            path VARCHAR PRIMARY KEY,
+            size BIGINT,
+            mtime DOUBLE,
+            content_hash VARCHAR,
+            tables VARCHAR[],
+            error VARCHAR,
+            ingested_at TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LINEAGE_TABLE} (
+            table_name VARCHAR PRIMARY KEY,
+            source_path VARCHAR,
+            row_count BIGINT,
+            ingested_at TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS table_lineage_source_idx "
+        f"ON {LINEAGE_TABLE} (source_path)"
+    )
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PROFILE_TABLE} (
+            table_name VARCHAR,
+            column_name VARCHAR,
+            column_type VARCHAR,
+            null_ratio DOUBLE,
+            approx_distinct BIGINT,
+            min_value VARCHAR,
+            max_value VARCHAR,
+            top_values VARCHAR[],
+            profiled_at TIMESTAMP,
+            PRIMARY KEY (table_name, column_name)
+        )
+        """
+    )
+
+
+def has_manifest_table(conn):
+    """Indique si la base contient déjà un manifeste d'ingestion."""
+    return (
+        conn.execute(
+            "SELECT count(*) FROM information_schema.tables "
+            "WHERE table_schema = ? AND table_name = ?",
+            [CATALOG_SCHEMA, MANIFEST_TABLE.split(".")[1]],
+        ).fetchone()[0]
+        > 0
+    )
+
+
+def compute_content_hash(filepath):
+    """Calcule l'empreinte BLAKE2 du contenu d'un fichier, lu par blocs."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(filepath):
+    """Retourne la taille, la date de modification et l'empreinte d'un fichier."""
+    stat = os.stat(filepath)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "content_hash": compute_content_hash(filepath),
+    }
+
+
+def load_manifest(conn):
+    """Charge le manifeste sous forme de dictionnaire indexé par chemin absolu."""
+    rows = conn.execute(
+        f"SELECT path, size, mtime, content_hash, tables, error FROM {MANIFEST_TABLE}"
+    ).fetchall()
+    return {
+        path: {
+            "size": size,
+            "mtime": mtime,
+            "content_hash": content_hash,
+            "tables": list(tables or []),
+            "error": error,
+        }
+        for path, size, mtime, content_hash, tables, error in rows
+    }
+
+
+def file_status(filepath, entry):
+    """
+    Compare un fichier à son entrée du manifeste et retourne (statut, empreinte).
+    Le statut vaut « new », « changed », « touched » (date modifiée mais contenu
+    identique) ou « unchanged ». Le contenu n'est relu que si la taille ou la date
+    de modification ont changé.
+    """
+    if entry is None:
+        return "new", file_fingerprint(filepath)
+
+    stat = os.stat(filepath)
+    if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+        return "unchanged", {
+            "size": entry["size"],
+            "mtime": entry["mtime"],
+            "content_hash": entry["content_hash"],
+        }
+
+    fingerprint = file_fingerprint(filepath)
+    if fingerprint["content_hash"] == entry["content_hash"]:
+        return "touched", fingerprint
+    return "changed", fingerprint
+
+
+def record_ingestion(conn, filepath, fingerprint, tables, error=None):
+    """Enregistre (ou remplace) l'entrée du manifeste d'un fichier."""
+    path = os.path.abspath(filepath)
+    conn.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE path = ?", [path])
+    conn.execute(
+        f"INSERT INTO {MANIFEST_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            path,
+            fingerprint["size"],
+            fingerprint["mtime"],
+            fingerprint["content_hash"],
+            list(tables),
+            error,
+            datetime.now(),
+        ],
+    )
+
+
+def record_lineage(conn, filepath, tables):
+    """
+    Associe chaque table publiée à son fichier source, avec son nombre de lignes.
+    Une table reprise par un autre fichier change de propriétaire.
+    """
+    path = os.path.abspath(filepath)
+    ingested_at = datetime.now()
+    for table_name in tables:
+        row_count = conn.execute(f"SELECT count(*) FROM {table_name}").fetchone()[0]
+        conn.execute(f"DELETE FROM {LINEAGE_TABLE} WHERE table_name = ?", [table_name])
+        conn.execute(
+            f"INSERT INTO {LINEAGE_TABLE} VALUES (?, ?, ?, ?)",
+            [table_name, path, row_count, ingested_at],
+        )
+
+
+def record_profiles(conn, table_name, profiles):
+    """Enregistre (ou remplace) les profils des colonnes d'une table."""
+    conn.execute(f"DELETE FROM {PROFILE_TABLE} WHERE table_name = ?", [table_name])
+    profiled_at = datetime.now()
+    for profile in profiles:
+        conn.execute(
+            f"INSERT INTO {PROFILE_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                table_name,
+                profile["column_name"],
+                profile["column_type"],
+                profile["null_ratio"],
+                profile["approx_distinct"],
+                profile["min_value"],
+                profile["max_value"],
+                profile["top_values"],
+                profiled_at,
+            ],
+        )
+
+
+def load_profiles(conn):
+    """Charge les profils de colonnes sous forme de dictionnaire {table: {colonne: profil}}."""
+    rows = conn.execute(
+        f"SELECT table_name, column_name, column_type, null_ratio, approx_distinct, "
+        f"min_value, max_value, top_values FROM {PROFILE_TABLE}"
+    ).fetchall()
+    profiles = {}
+    for (
+        table_name,
+        column_name,
+        column_type,
+        null_ratio,
+        approx_distinct,
+        min_value,
+        max_value,
+        top_values,
+    ) in rows:
+        profiles.setdefault(table_name, {})[column_name] = {
+            "column_name": column_name,
+            "column_type": column_type,
+            "null_ratio": null_ratio,
+            "approx_distinct": approx_distinct,
+            "min_value": min_value,
+            "max_value": max_value,
+            "top_values": list(top_values or []),
+        }
+    return profiles
+
+
+def unprofiled_tables(conn):
+    """Retourne les tables du catalogue de lignage qui n'ont pas encore de profil."""
+    rows = conn.execute(
+        f"SELECT table_name FROM {LINEAGE_TABLE} WHERE table_name NOT IN "
+        f"(SELECT table_name FROM {PROFILE_TABLE}) ORDER BY table_name"
+    ).fetchall()
+    return [table_name for (table_name,) in rows]
+
+
+def source_tables(conn, filepath):
+    """Retourne les tables construites à partir d'un fichier d'après le catalogue de lignage."""
+    rows = conn.execute(
+        f"SELECT table_name FROM {LINEAGE_TABLE} WHERE source_path = ? ORDER BY table_name",
+        [os.path.abspath(filepath)],
+    ).fetchall()
+    return [table_name for (table_name,) in rows]
+
+
+def table_source(conn, table_name):
+    """Retourne le fichier source d'une table, ou None si elle n'est pas dans le catalogue."""
+    row = conn.execute(
+        f"SELECT source_path FROM {LINEAGE_TABLE} WHERE table_name = ?", [table_name]
+    ).fetchone()
+    return row[0] if row else None
+
+
+def manifest_tables(conn, filepath):
+    """Retourne les tables enregistrées pour un fichier dans le manifeste."""
+    row = conn.execute(
+        f"SELECT tables FROM {MANIFEST_TABLE} WHERE path = ?",
+        [os.path.abspath(filepath)],
+    ).fetchone()
+    return list(row[0] or []) if row else []
+
+
+def forget_file(conn, filepath):
+    """
+    Supprime les tables construites à partir d'un fichier, leur lignage, leurs profils
+    et l'entrée du fichier dans le manifeste. Seules les tables dont le fichier est propriétaire
+    d'après le catalogue de lignage sont supprimées.
+    """
+    path = os.path.abspath(filepath)
+    tables = source_tables(conn, path)
+    # Tables créées avant l'existence du catalogue de lignage : connues du seul manifeste
+    tables += [
+        table_name
+        for table_name in manifest_tables(conn, path)
+        if table_name not in tables and table_source(conn, table_name) is None
+    ]
+    for table_name in tables:
+        print(f"Dropping table: {table_name}")
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        conn.execute(f"DELETE FROM {PROFILE_TABLE} WHERE table_name = ?", [table_name])
+    conn.execute(f"DELETE FROM {LINEAGE_TABLE} WHERE source_path = ?", [path])
+    conn.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE path = ?", [path])
+    return tables
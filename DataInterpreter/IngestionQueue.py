@@ -0,0 +1,183 @@
+import itertools
+import os
+import queue
+import threading
+from datetime import datetime
+
+from DatabaseConnection import bump_database_version, connect_database
+from IngestionManifest import ensure_manifest_table, forget_file
+from QueryLog import refresh_materializations
+from SetupDatabase import (
+    ingest_files,
+    print_ingestion_report,
+    synchronize_with_manifest,
+)
+
+# Ordre de traitement : les suppressions d'abord, puis les formats rapides à charger,
+# l'OCR et la description d'images des PDF en dernier
+REMOVAL_PRIORITY = -1
+EXTENSION_PRIORITIES = {
+    ".csv": 0,
+    ".json": 0,
+    ".ndjson": 0,
+    ".jsonl": 0,
+    ".parquet": 0,
+    ".xls": 1,
+    ".xlsx": 1,
+    ".xlsm": 1,
+    ".py": 1,
+    ".pdf": 2,
+}
+DEFAULT_PRIORITY = 1
+
+# États d'un fichier soumis à la file d'ingestion
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def ingestion_priority(filepath):
+    """Priorité d'un fichier : (classe de format, taille), la plus petite passe en premier."""
+    extension = os.path.splitext(filepath)[1].lower()
+    try:
+        size = os.path.getsize(filepath)
+    except OSError:
+        size = 0
+    return EXTENSION_PRIORITIES.get(extension, DEFAULT_PRIORITY), size
+
+
+class IngestionQueue:
+    """
+    File d'ingestion traitée par un thread d'arrière-plan, seul écrivain de la base.
+    Les requêtes des utilisateurs ne l'attendent jamais : elles lisent les données
+    déjà publiées et peuvent consulter l'état des fichiers encore en cours.
+    """
+
+    def __init__(self, ollama_model=None, workers=1):
+        self.ollama_model = ollama_model
+        self.workers = workers
+        self._jobs = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._status = {}
+        self._thread = None
+
+    def start(self):
+        """Démarre le thread d'ingestion s'il ne tourne pas déjà."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="ingestion-queue", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Arrête le thread après le fichier en cours ; les fichiers en attente sont abandonnés."""
+        if self._thread is not None:
+            # Le signal d'arrêt passe devant toutes les tâches en attente
+            self._jobs.put(((float("-inf"),), next(self._sequence), None, None))
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, filepath, action="ingest"):
+        """
+        Ajoute un fichier à ingérer (« ingest ») ou à retirer (« remove ») de la base.
+        Retourne False si la même opération est déjà en attente pour ce fichier.
+        """
+        path = os.path.abspath(filepath)
+        priority = (
+            (REMOVAL_PRIORITY,) if action == "remove" else ingestion_priority(path)
+        )
+        with self._lock:
+            current = self._status.get(path)
+            if current and current["state"] == QUEUED and current["action"] == action:
+                return False
+            sequence = next(self._sequence)
+            self._status[path] = {
+                "action": action,
+                "state": QUEUED,
+                "priority": priority,
+                "sequence": sequence,
+                "submitted_at": datetime.now(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+            }
+        self._jobs.put((priority, sequence, action, path))
+        print(f"Queued {action} of {path} (priority {priority}).")
+        return True
+
+    def status(self, filepath=None):
+        """Retourne l'état d'un fichier, ou de tous les fichiers soumis."""
+        with self._lock:
+            if filepath is not None:
+                entry = self._status.get(os.path.abspath(filepath))
+                return dict(entry) if entry else None
+            return {path: dict(entry) for path, entry in self._status.items()}
+
+    def pending_files(self):
+        """Retourne les fichiers en attente ou en cours de traitement, par ordre de priorité."""
+        with self._lock:
+            pending = [
+                (entry["priority"], entry["sequence"], path)
+                for path, entry in self._status.items()
+                if entry["state"] in (QUEUED, RUNNING)
+            ]
+        return [path for _, _, path in sorted(pending)]
+
+    def _run(self):
+        while True:
+            _, sequence, action, path = self._jobs.get()
+            if action is None:
+                break
+            with self._lock:
+                entry = self._status.get(path)
+                # Une soumission plus récente pour ce fichier remplace celle-ci
+                if entry is None or entry["sequence"] != sequence:
+                    continue
+                entry["state"] = RUNNING
+                entry["started_at"] = datetime.now()
+
+            try:
+                if action == "remove":
+                    error = self._remove(path)
+                else:
+                    error = self._ingest(path)
+            except Exception as e:
+                error = str(e)
+            if error:
+                print(f"Error during {action} of {path}: {error}")
+
+            with self._lock:
+                entry["state"] = FAILED if error else DONE
+                entry["finished_at"] = datetime.now()
+                entry["error"] = error
+
+    def _ingest(self, path):
+        """(Re)charge un fichier s'il est nouveau ou modifié et retourne son erreur éventuelle."""
+        if not os.path.isfile(path):
+            return "File not found"
+        filepaths, fingerprints = synchronize_with_manifest(None, [path])
+        if not filepaths:
+            return None
+        report = ingest_files(filepaths, self.ollama_model, self.workers, fingerprints)
+        print_ingestion_report(report)
+        return next((result["error"] for result in report if result["error"]), None)
+
+    def _remove(self, path):
+        """Retire de la base les tables produites par un fichier supprimé."""
+        conn = connect_database()
+        try:
+            ensure_manifest_table(conn)
+            conn.begin()
+            try:
+                tables = forget_file(conn, path)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                return str(e)
+            bump_database_version(tables)
+            refresh_materializations(conn, tables)
+        finally:
+            conn.close()
+        return None
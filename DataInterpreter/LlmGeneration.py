@@ -1,6 +1,23 @@
-from SqlTool import execute_sql_query
+from SqlTool import (
+    execute_sql_batch,
+    qualify_columns,
+    validate_sql_query,
+)
 from PythonTool import parse_and_execute_python_code
+from SchemaIndex import describe_table
+from Tracing import span, start_span, traced
+import os
 import re
+import time
+
+
+def invoke_model(stage, model, prompt):
+    """Appelle un modèle dans un span qui relève la taille du prompt et de la réponse."""
+    with span(stage, model=getattr(model, "model", None), prompt_chars=len(prompt)) as current:
+        response = model.invoke(prompt)
+        current.set(response_chars=len(response))
+        return response
+
 
 def command_r_plus_plan(question, schema, contextualisation_model):
     """
@@ -8,10 +25,8 @@ def command_r_plus_plan(question, schema, contextualisation_model):
     """
     schema_description = "Voici le schéma de la base de données :\n"
     for table_name, columns in schema.items():
-        schema_description += f"Table '{table_name}' contient les colonnes suivantes :\n"
-        for column in columns:
-            schema_description += f"  - '{column['name']}' (type: {column['type']})\n"
-        schema_description += "\n"
+        # Profils calculés à l'ingestion : valeurs fréquentes, bornes, valeurs nulles
+        schema_description += describe_table(table_name, columns, with_profiles=True)
 
     print("voici le schema : ", schema_description)
 
@@ -33,22 +48,19 @@ def command_r_plus_plan(question, schema, contextualisation_model):
     )
 
     print(f"Generating plan for question: {question}")
-    plan = contextualisation_model.invoke(prompt)
+    plan = invoke_model("llm.plan", contextualisation_model, prompt)
     print(f"Generated Plan: {plan}")
     return plan
 
-def adjust_sql_query_with_duckdb(sql_query, schema, duckdb_model):
+
+def adjust_sql_query_with_duckdb(sql_query, schema, duckdb_model, validation_errors=None):
     """
-    Ajuste une requête SQL en fonction du moteur DuckDB, en gérant les erreurs de types.
+    Ajuste une requête SQL en fonction du moteur DuckDB, en gérant les erreurs de types
+    et les erreurs relevées par la validation de la requête.
     """
     schema_description = "Voici le schéma de la base de données pour DuckDB :\n"
     for table_name, columns in schema.items():
-        schema_description += (
-            f"Table '{table_name}' contient les colonnes suivantes :\n"
-        )
-        for column in columns:
-            schema_description += f"  - '{column['name']}' (type: {column['type']})\n"
-        schema_description += "\n"
+        schema_description += describe_table(table_name, columns)
 
     """prompt = (
         f"{schema_description}\n\n"
@@ -67,83 +79,32 @@ def adjust_sql_query_with_duckdb(sql_query, schema, duckdb_model):
         "- If a type mismatch is detected (e.g., INTEGER vs VARCHAR), add explicit casting.\n"
         "- Provide only a corrected and optimized SQL query within a ```sql``` block."
     )
+    if validation_errors:
+        prompt += "\n\nDuckDB reported the following errors for this query:\n" + "\n".join(
+            f"- {error['message']}" for error in validation_errors
+        )
 
     print("Adjusting SQL query with DuckDB model...")
     try:
-        adjusted_query = duckdb_model.invoke(prompt)
+        adjusted_query = invoke_model("llm.adjust_sql", duckdb_model, prompt)
         print(f"Adjusted SQL query: {adjusted_query}")
-        return adjusted_query
+        # Seule la requête du bloc ```sql``` demandé est validée puis exécutée
+        sql_blocks = re.findall(r"```sql(.*?)```", adjusted_query, re.DOTALL)
+        return sql_blocks[0].strip() if sql_blocks else adjusted_query
     except Exception as e:
         print(f"Erreur lors de l'ajustement de la requête SQL : {e}")
         raise
 
 
-def validate_sql_with_schema(schema, query):
-    """
-    Valide que les colonnes utilisées dans la requête existent dans les tables référencées.
-    """
-    print("Validating SQL query against schema...")
-    try:
-        column_map = {
-            table: [col["name"] for col in cols] for table, cols in schema.items()
-        }
-
-        # Extraire les tables utilisées dans la requête
-        tables_in_query = set(
-            re.findall(r"\bFROM\s+(\w+)|\bJOIN\s+(\w+)", query, flags=re.IGNORECASE)
-        )
-        tables_in_query = {
-            table for match in tables_in_query for table in match if table
-        }
-
-        # Vérifier les colonnes référencées dans les tables utilisées
-        missing_columns = []
-        for table in tables_in_query:
-            if table in column_map:
-                for column in re.findall(rf"{table}\.(\w+)", query):
-                    if column not in column_map[table]:
-                        missing_columns.append(f"{table}.{column}")
-            else:
-                missing_columns.append(f"Table inconnue référencée : {table}")
-
-        if missing_columns:
-            raise ValueError(
-                f"Colonnes ou tables manquantes dans le schéma : {missing_columns}"
-            )
-
-        print("SQL query validation successful.")
-        return True
-    except Exception as e:
-        print(f"Erreur de validation SQL : {e}")
-        raise
-
-
 def clean_sql_query(sql_query, schema):
     """
-    Nettoie et simplifie une requête SQL générée :
-    - Supprime les alias inutiles.
-    - Remplace les colonnes ambiguës par leur nom complet uniquement si elles sont utilisées dans la requête.
+    Nettoie une requête SQL générée : les colonnes non qualifiées sont préfixées par
+    la table de la clause FROM qui les fournit (voir qualify_columns).
     """
     print("Cleaning SQL query...")
     try:
-        # Construire une map des colonnes par table
-        column_map = {
-            table: [col["name"] for col in cols] for table, cols in schema.items()
-        }
-
-        # Supprimer les alias inutiles
-        #sql_query = re.sub(r"\bAS\s+\w+\b", "", sql_query, flags=re.IGNORECASE)
-
-        # Ajouter les noms complets uniquement pour les colonnes ambiguës
-        for table, columns in column_map.items():
-            for column in columns:
-                pattern = rf"(?<!\.)\b{column}\b(?!\.)"  # Colonne sans préfixe
-                replacement = f"{table}.{column}"
-                if re.search(pattern, sql_query):  # Vérifier si la colonne existe
-                    sql_query = re.sub(pattern, replacement, sql_query)
-
-        # Supprimer les espaces multiples et extra blancs
-        sql_query = re.sub(r"\s+", " ", sql_query).strip()
+        with span("clean_sql_query", query_chars=len(sql_query)):
+            sql_query = qualify_columns(sql_query.strip(), schema)
         print("Cleaned SQL query:", sql_query)
         return sql_query
     except Exception as e:
@@ -164,15 +125,20 @@ def extract_sql_from_plan(plan_text):
     raise ValueError("Aucune requête SQL trouvée dans le plan.")
 
 
-def generate_tools_with_llm(plan, schema, context, sql_results, python_results, database_model, reasoning_model):
+@traced()
+def generate_tools_with_llm(plan, schema, context, sql_results, python_results, database_model, reasoning_model, on_progress=None):
     """
-    Génère les outils nécessaires en fonction du plan.
+    Génère les outils nécessaires en fonction du plan. `on_progress`, s'il est
+    fourni, reçoit un court message à la fin de chaque étape (SQL, Python).
     """
+    on_progress = on_progress or (lambda message: None)
     print("Generating tools based on the plan...")
     files_generated = []
-    results = []
+    sql_errors = []
 
     if "SQL" in plan:
+        # Résultats de toutes les instructions de toutes les requêtes du plan
+        sql_results = []
         try:
             # Extraction de la requête SQL depuis le plan
             sql_queries = extract_sql_from_plan(plan)
@@ -181,15 +147,46 @@ def generate_tools_with_llm(plan, schema, context, sql_results, python_results,
                 # Nettoyage et validation des étapes SQL
                 sql_query = clean_sql_query(sql_query, schema)
                 print(f"Cleaned SQL Query: {sql_query}")
-                validate_sql_with_schema(schema, sql_query)
-                # Ajustement avec DuckDB (type casting ou corrections spécifiques)
-                sql_query = adjust_sql_query_with_duckdb(sql_query, schema, database_model)
+                # Validation par l'analyseur et le binder de DuckDB, sans exécution
+                with span("validate_sql_query") as current:
+                    validation_errors = validate_sql_query(sql_query)
+                    current.set(errors=len(validation_errors))
+                # Ajustement avec DuckDB (type casting, corrections des erreurs de validation)
+                sql_query = adjust_sql_query_with_duckdb(
+                    sql_query, schema, database_model, validation_errors
+                )
                 print(f"Adjusted SQL Query: {sql_query}")
-                # Exécuter la requête ajustée
-                sql_results = execute_sql_query(sql_query)
+                with span("validate_sql_query") as current:
+                    validation_errors = validate_sql_query(sql_query)
+                    current.set(errors=len(validation_errors))
+                if validation_errors:
+                    # Seule cette requête est écartée : les suivantes sont exécutées
+                    print(f"Requête SQL invalide, non exécutée : {validation_errors}")
+                    sql_errors.extend(validation_errors)
+                    continue
+                # Exécuter la requête ajustée, instruction par instruction
+                for statement in execute_sql_batch(sql_query):
+                    # Instructions interrompues (délai dépassé), en échec ou annulées, à signaler dans la réponse
+                    if statement["error"]:
+                        sql_errors.append(statement["error"])
+                    elif statement["rolled_back"]:
+                        sql_errors.append(
+                            {
+                                "error": "rolled_back",
+                                "message": "Executed, then rolled back with its transaction.",
+                                "query": statement["query"],
+                                "elapsed_seconds": statement["elapsed_seconds"],
+                            }
+                        )
+                    elif statement["result"] is not None:
+                        sql_results.append(statement["result"])
                 print(f"SQL Query Results: {sql_results}")
-                results.append(sql_results)
             context["sql_results"] = sql_results
+            context["sql_errors"] = sql_errors
+            on_progress(
+                f"Requêtes SQL exécutées : {len(sql_results)} résultat(s), "
+                f"{len(sql_errors)} erreur(s)"
+            )
 
         except Exception as e:
             print(f"Erreur lors de l'exécution de la requête SQL : {e}")
@@ -212,21 +209,28 @@ def generate_tools_with_llm(plan, schema, context, sql_results, python_results,
             "8. For graphical results, ensure that files are saved without worrying about format or naming (e.g., use default names).\n\n"
             "9. Whether the request involves a graph, a calculation, or another operation, generate the code using only the extracted values, maximizing the included elements to provide a complete view, without inventing data.\n"
             "10. Whether the request involves a graph, a calculation, or another operation, generate the code using only the extracted values, maximizing the included elements to provide a complete view, without inventing data.\n"
-            f"Here are the available SQL results:\n{sql_results}\n\n"
+            f"Here are the available SQL results:\n{format_sql_results(sql_results)}\n\n"
+            f"These SQL queries failed, their data is not available:\n{format_sql_errors(sql_errors)}\n\n"
             "**Generate complete Python code that uses these results as static data.** The code must directly address the request (graph, calculation, or other) and **never** make calls to databases such as SQLite or external services to retrieve data."
         )
 
-        python_tool = reasoning_model.invoke(prompt)
+        python_tool = invoke_model("llm.python_code", reasoning_model, prompt)
         context, python_results, files_generated = parse_and_execute_python_code(
             python_tool, context, sql_results
         )
+        if files_generated:
+            on_progress(
+                "Fichiers générés : "
+                + ", ".join(os.path.basename(str(file)) for file in files_generated)
+            )
+        else:
+            on_progress("Code Python exécuté")
 
     return context, python_results, sql_results, files_generated
 
-def generate_final_response_with_llama(
-    context, sql_results, python_results, reasoning_model, files_generated
-):
-    print("avant la réponse", files_generated)
+
+def build_final_prompt(context, sql_results, python_results, files_generated):
+    """Construit le prompt de la réponse finale à partir du contexte et des résultats."""
     # Créer la section des fichiers générés
     files_section = ""
     if files_generated:
@@ -234,12 +238,11 @@ def generate_final_response_with_llama(
             [f"- {file}" for file in files_generated]
         )
 
-    # Construction du prompt
-    print(f"Generating final response with context: {context}")
-    prompt = (
+    return (
         f"Final context:\n\n"
         f"Question: \"{context['question']}\"\n"
-        f"SQL Results: {sql_results}\n"
+        f"SQL Results:\n{format_sql_results(sql_results)}\n"
+        f"SQL Errors:\n{format_sql_errors(context.get('sql_errors'))}\n"
         f"Python Results: {python_results}\n\n"
         f"{files_section}\n\n"
         "**Final Answer:**\n"
@@ -249,21 +252,105 @@ def generate_final_response_with_llama(
         "1. If files have been generated (mentioned above), briefly explain their content and relevance to the request.\n"
         "2. If the response includes numerical results, ensure they are well-contextualized for immediate understanding.\n"
         "3. Do not provide any technical explanations not requested by the initial question. Focus on delivering an explanation understandable to the end user.\n"
-        "4. Explicitly mention the links to the created files (listed above) in the response."
+        "4. Explicitly mention the links to the created files (listed above) in the response.\n"
+        "5. If a SQL result is marked as truncated, give its total row count and say that the figures only cover the rows shown.\n"
+        "6. If SQL errors are listed, tell the user which queries failed (timeout, invalid query, rolled back...) and that the answer does not include their data."
     )
 
+
+def format_sql_results(sql_results):
+    """
+    Décrit les résultats SQL pour un prompt : nombre total de lignes de chaque
+    résultat, troncature éventuelle de l'aperçu, colonnes et lignes.
+    """
+    if not sql_results:
+        return "None"
+    sections = []
+    for index, result in enumerate(sql_results, start=1):
+        summary = f"Result {index}: {result['row_count']} row(s) in total"
+        if result["truncated"]:
+            summary += f", TRUNCATED to the first {len(result['data'])} row(s)"
+        sections.append(f"{summary}\nColumns: {result['columns']}\nRows: {result['data']}")
+    return "\n".join(sections)
+
+
+def format_sql_errors(sql_errors):
+    """Décrit les erreurs SQL structurées (voir query_error) pour un prompt, une par ligne."""
+    if not sql_errors:
+        return "None"
+    return "\n".join(
+        f"- {error['error']}: {error['message']} (query: {error['query']})"
+        for error in sql_errors
+    )
+
+
+def files_links_section(files_generated):
+    """Liens des fichiers générés, ajoutés à la fin de la réponse s'ils existent."""
+    if not files_generated:
+        return ""
+    return "\n\nLiens des fichiers générés :\n" + "\n".join(
+        [f"- {file}" for file in files_generated]
+    )
+
+
+def generate_final_response_with_llama(
+    context, sql_results, python_results, reasoning_model, files_generated
+):
+    print("avant la réponse", files_generated)
+    # Construction du prompt
+    print(f"Generating final response with context: {context}")
+    prompt = build_final_prompt(context, sql_results, python_results, files_generated)
+
     # Appel au modèle pour générer la réponse finale
-    final_response = reasoning_model.invoke(prompt)
+    final_response = invoke_model("llm.final_response", reasoning_model, prompt)
     print("après la réponse", files_generated)
 
-    # Ajouter les liens des fichiers générés à la fin de la réponse, s'ils existent
-    if files_generated:
-        links_section = "\n\nLiens des fichiers générés :\n" + "\n".join(
-            [f"- {file}" for file in files_generated]
-        )
-        final_response += links_section
+    final_response += files_links_section(files_generated)
 
     # Afficher la réponse finale
     print(f"Final response: {final_response}")
     return final_response
 
+
+def stream_final_response_with_llama(
+    context, sql_results, python_results, reasoning_model, files_generated
+):
+    """
+    Variante de generate_final_response_with_llama qui retourne la réponse finale
+    sous forme de générateur des tokens du modèle (OllamaLLM.stream), suivis des
+    liens des fichiers.
+    """
+    print(f"Streaming final response with context: {context}")
+    prompt = build_final_prompt(context, sql_results, python_results, files_generated)
+    # Span démarré ici, dans le contexte de la requête, et terminé à la fin du flux,
+    # qui peut être lu depuis un autre thread
+    current = start_span(
+        "llm.final_response",
+        model=getattr(reasoning_model, "model", None),
+        prompt_chars=len(prompt),
+        streamed=True,
+    )
+    return stream_tokens(reasoning_model, prompt, files_generated, current)
+
+
+def stream_tokens(reasoning_model, prompt, files_generated, current):
+    """Transmet les tokens du modèle puis les liens des fichiers, et termine le span `current`."""
+    started = time.perf_counter()
+    final_response = ""
+    try:
+        for chunk in reasoning_model.stream(prompt):
+            if not final_response:
+                current.set(first_token_seconds=round(time.perf_counter() - started, 6))
+            final_response += chunk
+            yield chunk
+    except Exception as e:
+        current.end(e)
+        raise
+    finally:
+        current.set(response_chars=len(final_response))
+        current.end()
+
+    links_section = files_links_section(files_generated)
+    if links_section:
+        yield links_section
+    print(f"Final response: {final_response}{links_section}")
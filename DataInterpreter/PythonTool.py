@@ -8,6 +8,7 @@ import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import shutil
+from Tracing import current_span, span, traced
 
 active_observers = []
 observed_directories = set()
@@ -106,6 +107,7 @@ def watch_directories(directories, stop_event):
         observer.join()
 
 
+@traced()
 def parse_and_execute_python_code(tool, context, sql_results):
     global created_paths, observed_directories
     created_paths = (
@@ -122,6 +124,7 @@ def parse_and_execute_python_code(tool, context, sql_results):
 
     code = code_match.group(1).strip()
     print(f"Parsed Python code: {code}")
+    current_span().set(code_chars=len(code))
 
     stop_event = threading.Event()
     directories_to_watch = [
@@ -135,7 +138,8 @@ def parse_and_execute_python_code(tool, context, sql_results):
     watch_thread.start()
 
     # Attendre un peu pour être sûr que le thread de surveillance est en cours
-    time.sleep(1)
+    with span("python.watch_startup"):
+        time.sleep(1)
 
     # Analyser les imports du code
     imports = re.findall(
@@ -155,7 +159,8 @@ def parse_and_execute_python_code(tool, context, sql_results):
         except ImportError:
             print(f"Module {module} not found, attempting to install...")
             try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install", module])
+                with span("python.install_module", module=module):
+                    subprocess.check_call([sys.executable, "-m", "pip", "install", module])
             except subprocess.CalledProcessError as e:
                 print(f"Failed to install module {module}. Error: {e}")
                 context["error"] = f"Failed to install module {module}. Error: {e}"
@@ -168,7 +173,8 @@ def parse_and_execute_python_code(tool, context, sql_results):
 
     try:
         print(f"Executing Python code: {code}")
-        exec(code, exec_context)
+        with span("python.exec"):
+            exec(code, exec_context)
         context["python_results"] = "Python results obtained"
         python_res = "Python results obtained"
         print("Python results obtained")
@@ -178,11 +184,12 @@ def parse_and_execute_python_code(tool, context, sql_results):
         python_res = ""
 
     # Attendre un peu plus longtemps pour donner le temps aux nouveaux fichiers/dossiers d'être créés et détectés
-    time.sleep(5)  # Ajustez la durée si nécessaire
+    with span("python.watch_settle"):
+        time.sleep(5)  # Ajustez la durée si nécessaire
 
-    # Arrêter la surveillance après le délai
-    stop_event.set()
-    watch_thread.join()
+        # Arrêter la surveillance après le délai
+        stop_event.set()
+        watch_thread.join()
 
     # Ajouter les chemins créés au contexte et les retourner
     # context["created_paths"] = created_paths
@@ -195,5 +202,6 @@ def parse_and_execute_python_code(tool, context, sql_results):
     )
 
     print(f"Liens créés: {created_paths}")
+    current_span().set(files=len(context["created_paths"]))
 
     return context, python_res, context["created_paths"]
@@ -0,0 +1,213 @@
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from DatabaseConnection import database_version, table_version
+
+# Budget mémoire (estimé) des résultats conservés dans le cache
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Mots-clés qui lisent l'heure courante sans parenthèses, vus comme des colonnes par l'analyseur
+TIME_KEYWORDS = {
+    "current_date",
+    "current_time",
+    "current_timestamp",
+    "localtime",
+    "localtimestamp",
+}
+
+# Fonctions dont le résultat change d'un appel à l'autre (now(), random()...), lues une fois dans duckdb_functions()
+_volatile_functions = None
+
+# Chaînes et identifiants entre guillemets, commentaires, espaces
+SQL_TOKEN_PATTERN = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(--[^\n]*|/\*.*?\*/)|(\s+)""",
+    re.DOTALL,
+)
+
+
+def normalize_sql(query):
+    """
+    Normalise une requête pour l'utiliser comme clé de cache : commentaires retirés,
+    espaces réduits, mots en minuscules (DuckDB ignore la casse des identifiants non
+    protégés) ; le contenu des chaînes et des identifiants entre guillemets est conservé.
+    """
+    normalized = ""
+    position = 0
+    for match in SQL_TOKEN_PATTERN.finditer(query):
+        normalized += query[position:match.start()].lower()
+        quoted = match.group(1)
+        if quoted:
+            normalized += quoted
+        elif not normalized.endswith(" "):
+            normalized += " "
+        position = match.end()
+    normalized += query[position:].lower()
+    return normalized.strip().rstrip(";").strip()
+
+
+def volatile_functions(con):
+    """Retourne les fonctions que DuckDB déclare volatiles ou constantes seulement dans une requête."""
+    global _volatile_functions
+    if _volatile_functions is None:
+        rows = con.execute(
+            "SELECT DISTINCT function_name FROM duckdb_functions() "
+            "WHERE stability IN ('VOLATILE', 'CONSISTENT_WITHIN_QUERY')"
+        ).fetchall()
+        _volatile_functions = {function_name.lower() for (function_name,) in rows}
+    return _volatile_functions
+
+
+def is_deterministic_query(con, query):
+    """
+    Indique si une lecture retourne toujours le même résultat sur les mêmes données,
+    d'après l'arbre produit par DuckDB : une requête qui lit l'heure courante ou
+    appelle une fonction volatile (now(), current_date, random(), nextval()...), ou
+    qui échantillonne une table, ne peut être ni mise en cache ni matérialisée.
+    """
+    try:
+        serialized = con.execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0]
+    except duckdb.Error:
+        return False
+    serialized = json.loads(serialized)
+    if serialized.get("error"):
+        return False
+
+    volatile = volatile_functions(con)
+    nodes = [serialized["statements"]]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, list):
+            nodes.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        if node.get("class") == "FUNCTION" and node["function_name"].lower() in volatile:
+            return False
+        if (
+            node.get("class") == "COLUMN_REF"
+            and len(node["column_names"]) == 1
+            and node["column_names"][0].lower() in TIME_KEYWORDS
+        ):
+            return False
+        if node.get("sample"):
+            return False
+        nodes.extend(node.values())
+    return True
+
+
+def query_tables(query):
+    """Retourne les tables lues par une requête, ou None si elles ne peuvent être déterminées."""
+    try:
+        return {table_name.lower() for table_name in duckdb.get_table_names(query)}
+    except duckdb.Error:
+        return None
+
+
+def estimate_size(value):
+    """Estime la mémoire occupée par un résultat (tables Arrow, DataFrames, listes, dictionnaires)."""
+    if isinstance(value, pa.Table):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_size(item) for item in value)
+    return size
+
+
+class QueryResultCache:
+    """
+    Cache LRU des résultats de requêtes, borné en octets. Une entrée reste valable
+    tant que la base n'a pas changé depuis son exécution, ou tant que les tables
+    lues par la requête n'ont pas été remplacées ni supprimées par l'ingestion.
+    """
+
+    def __init__(self, max_bytes=SQL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Retourne le résultat en cache pour une clé construite sur la requête normalisée, ou None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_current(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, key, result, tables, version):
+        """
+        Conserve le résultat d'une requête exécutée à la version `version` de la
+        base et qui lit `tables`. Un résultat plus gros que le budget n'est pas conservé.
+        """
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "result": result,
+                "tables": tables,
+                "version": version,
+                "size": size,
+            }
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Retourne les compteurs du cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _is_current(self, entry):
+        current_version = database_version()
+        if entry["version"] == current_version:
+            return True
+        # Une requête sans table (SHOW TABLES...) dépend de tout le catalogue
+        if not entry["tables"]:
+            return False
+        if all(table_version(table_name) <= entry["version"] for table_name in entry["tables"]):
+            entry["version"] = current_version
+            return True
+        return False
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import duckdb
+from DatabaseConnection import DUCKDB_READ_ONLY, database_version, table_version
+from IngestionManifest import CATALOG_SCHEMA
+
+# Nombre de requêtes distinctes suivies par le journal
+QUERY_LOG_MAX_ENTRIES = int(os.getenv("QUERY_LOG_MAX_ENTRIES", 1000))
+
+# Une agrégation est matérialisée après MATERIALIZE_MIN_HITS demandes si son
+# exécution prend en moyenne au moins MATERIALIZE_MIN_SECONDS (0 : jamais)
+MATERIALIZE_MIN_HITS = int(os.getenv("MATERIALIZE_MIN_HITS", 3))
+MATERIALIZE_MIN_SECONDS = float(os.getenv("MATERIALIZE_MIN_SECONDS", 0.5))
+
+# Schéma des tables matérialisées, absent du schéma envoyé aux modèles
+MATERIALIZED_SCHEMA = "_materialized"
+# Une ligne par requête matérialisée : requête, table de résumé et tables sources
+MATERIALIZATION_TABLE = f"{CATALOG_SCHEMA}.materialized_queries"
+
+# Version de la base à laquelle chaque table matérialisée a été construite dans ce processus
+_materialized_versions = {}
+# Requêtes matérialisées, relues quand la version de la base change
+_registry_cache = None
+_registry_lock = threading.Lock()
+
+
+class QueryLog:
+    """
+    Journal des requêtes de lecture, indexé par requête normalisée : nombre de
+    demandes (cache compris), nombre d'exécutions et durées d'exécution.
+    Seules les QUERY_LOG_MAX_ENTRIES requêtes les plus récentes sont conservées.
+    """
+
+    def __init__(self, max_entries=QUERY_LOG_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, normalized_query, query, elapsed_seconds=None, tables=None):
+        """
+        Enregistre une demande ; `elapsed_seconds` vaut None quand la requête n'a
+        pas été exécutée (résultat servi par le cache). Retourne l'entrée mise à jour.
+        """
+        with self._lock:
+            entry = self._entries.pop(normalized_query, None)
+            if entry is None:
+                entry = {
+                    "query": query,
+                    "tables": None,
+                    "hits": 0,
+                    "executions": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "last_seen": None,
+                }
+            entry["hits"] += 1
+            entry["last_seen"] = datetime.now()
+            if elapsed_seconds is not None:
+                entry["executions"] += 1
+                entry["total_seconds"] += elapsed_seconds
+                entry["max_seconds"] = max(entry["max_seconds"], elapsed_seconds)
+            if tables is not None:
+                entry["tables"] = tables
+            self._entries[normalized_query] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return dict(entry)
+
+    def top(self, limit=20):
+        """Retourne les requêtes les plus demandées, avec leur durée moyenne d'exécution."""
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["average_seconds"] = (
+                entry["total_seconds"] / entry["executions"] if entry["executions"] else None
+            )
+        entries.sort(key=lambda entry: (-entry["hits"], -entry["total_seconds"]))
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def is_hot(entry):
+    """Indique si une requête du journal est assez fréquente et coûteuse pour être matérialisée."""
+    if MATERIALIZE_MIN_HITS <= 0 or DUCKDB_READ_ONLY or not entry["executions"]:
+        return False
+    return (
+        entry["hits"] >= MATERIALIZE_MIN_HITS
+        and entry["total_seconds"] / entry["executions"] >= MATERIALIZE_MIN_SECONDS
+    )
+
+
+def is_aggregate_query(con, query):
+    """Indique si une requête est un SELECT avec GROUP BY, d'après l'arbre produit par DuckDB."""
+    try:
+        serialized = con.execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0]
+    except duckdb.Error:
+        return False
+    serialized = json.loads(serialized)
+    if serialized.get("error") or len(serialized["statements"]) != 1:
+        return False
+    node = serialized["statements"][0]["node"]
+    return node.get("type") == "SELECT_NODE" and bool(
+        node.get("group_expressions") or node.get("group_sets")
+    )
+
+
+def materialized_table_name(normalized_query):
+    digest = hashlib.blake2b(normalized_query.encode("utf-8"), digest_size=8).hexdigest()
+    return f"{MATERIALIZED_SCHEMA}.query_{digest}"
+
+
+def ensure_materialization_table(conn):
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {CATALOG_SCHEMA}")
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {MATERIALIZED_SCHEMA}")
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MATERIALIZATION_TABLE} (
+            normalized_query VARCHAR PRIMARY KEY,
+            query VARCHAR,
+            table_name VARCHAR,
+            source_tables VARCHAR[],
+            refreshed_at TIMESTAMP
+        )
+        """
+    )
+
+
+def load_materializations(conn):
+    """Charge les requêtes matérialisées, indexées par requête normalisée."""
+    try:
+        rows = conn.execute(
+            f"SELECT normalized_query, query, table_name, source_tables FROM {MATERIALIZATION_TABLE}"
+        ).fetchall()
+    except duckdb.CatalogException:
+        return {}
+    return {
+        normalized_query: {
+            "query": query,
+            "table_name": table_name,
+            "tables": set(source_tables or []),
+        }
+        for normalized_query, query, table_name, source_tables in rows
+    }
+
+
+def materialized_table(con, normalized_query):
+    """
+    Retourne la table matérialisée qui répond à une requête, ou None. Une table
+    dont une source a changé depuis sa construction n'est pas utilisée tant
+    qu'elle n'a pas été rafraîchie.
+    """
+    global _registry_cache
+    version = database_version()
+    with _registry_lock:
+        cached = _registry_cache
+    if cached is None or cached["version"] != version:
+        cached = {"version": version, "entries": load_materializations(con)}
+        with _registry_lock:
+            _registry_cache = cached
+
+    entry = cached["entries"].get(normalized_query)
+    if entry is None:
+        return None
+    built_version = _materialized_versions.get(entry["table_name"], 0)
+    if any(table_version(table_name) > built_version for table_name in entry["tables"]):
+        return None
+    return entry["table_name"]
+
+
+def materialize_query(con, normalized_query, query, tables, data, version):
+    """
+    Conserve dans une table le résultat complet (table Arrow) d'une agrégation
+    exécutée à la version `version` de la base, sans la réexécuter.
+    """
+    global _registry_cache
+    table_name = materialized_table_name(normalized_query)
+    ensure_materialization_table(con)
+    con.register("materialized_result", data)
+    con.begin()
+    try:
+        con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM materialized_result")
+        con.execute(
+            f"DELETE FROM {MATERIALIZATION_TABLE} WHERE normalized_query = ?", [normalized_query]
+        )
+        con.execute(
+            f"INSERT INTO {MATERIALIZATION_TABLE} VALUES (?, ?, ?, ?, ?)",
+            [normalized_query, query, table_name, sorted(tables), datetime.now()],
+        )
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.unregister("materialized_result")
+    _materialized_versions[table_name] = version
+    with _registry_lock:
+        _registry_cache = None
+    print(f"Requête fréquente matérialisée dans {table_name} : {query}")
+    return table_name
+
+
+def refresh_materializations(conn, tables):
+    """
+    Reconstruit les tables matérialisées qui lisent une des tables modifiées par
+    l'ingestion. Une requête qui ne peut plus être exécutée (table source
+    supprimée...) perd sa table matérialisée.
+    """
+    global _registry_cache
+    changed = {table_name.lower() for table_name in tables}
+    if not changed:
+        return
+    entries = load_materializations(conn)
+    for normalized_query, entry in entries.items():
+        if not entry["tables"] & changed:
+            continue
+        version = database_version()
+        conn.begin()
+        try:
+            conn.execute(f"CREATE OR REPLACE TABLE {entry['table_name']} AS {entry['query']}")
+            conn.execute(
+                f"UPDATE {MATERIALIZATION_TABLE} SET refreshed_at = ? WHERE normalized_query = ?",
+                [datetime.now(), normalized_query],
+            )
+            conn.commit()
+            _materialized_versions[entry["table_name"]] = version
+            print(f"Table matérialisée {entry['table_name']} rafraîchie.")
+        except duckdb.Error as e:
+            conn.rollback()
+            print(f"Table matérialisée {entry['table_name']} supprimée : {e}")
+            conn.execute(f"DROP TABLE IF EXISTS {entry['table_name']}")
+            conn.execute(
+                f"DELETE FROM {MATERIALIZATION_TABLE} WHERE normalized_query = ?",
+                [normalized_query],
+            )
+            _materialized_versions.pop(entry["table_name"], None)
+    with _registry_lock:
+        _registry_cache = None
@@ -0,0 +1,200 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from ColumnProfiles import describe_profile
+from DatabaseConnection import database_version
+
+# Nombre de tables envoyées aux modèles et budget de tokens de la description du schéma
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", 8))
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", 3000))
+
+# Valeurs d'exemple indexées par table : lignes lues, colonnes texte et longueur retenues
+SCHEMA_SAMPLE_ROWS = 5
+SCHEMA_SAMPLE_COLUMNS = 20
+SCHEMA_SAMPLE_VALUE_LENGTH = 100
+
+# Poids des champs d'une table dans l'index : le nom de table compte plus qu'une valeur
+TABLE_NAME_WEIGHT = 3
+COLUMN_NAME_WEIGHT = 2
+
+# Paramètres usuels de BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Nombre moyen de caractères par token, pour estimer la taille d'une description
+CHARS_PER_TOKEN = 4
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "by", "for", "from", "how", "in", "is", "it", "of",
+    "on", "or", "the", "to", "what", "which", "with", "au", "aux", "ce", "ces", "dans",
+    "de", "des", "du", "en", "est", "et", "la", "le", "les", "leur", "par", "pour",
+    "quel", "quelle", "quelles", "quels", "qui", "quoi", "sont", "sur", "un", "une",
+}
+
+# Dernier index construit, avec la version de la base à laquelle il l'a été
+_index_cache = None
+
+
+def tokenize(text):
+    """
+    Découpe un texte en tokens comparables : accents retirés, minuscules, noms
+    snake_case et camelCase séparés, pluriels simples ramenés au singulier.
+    """
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower()
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text):
+        if len(token) < 2 or token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token[-1] in "sx" and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def describe_table(table_name, columns, with_profiles=False):
+    """
+    Description d'une table telle qu'elle est envoyée aux modèles. Avec
+    `with_profiles`, chaque colonne profilée est suivie d'un résumé de ses valeurs.
+    """
+    description = f"Table '{table_name}' contient les colonnes suivantes :\n"
+    for column in columns:
+        details = f"type: {column['type']}"
+        if with_profiles and column.get("profile"):
+            summary = describe_profile(column["profile"])
+            if summary:
+                details += f"; {summary}"
+        description += f"  - '{column['name']}' ({details})\n"
+    return description + "\n"
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class SchemaIndex:
+    """Index BM25 des tables : nom de table, noms de colonnes et valeurs d'exemple."""
+
+    def __init__(self, schema, samples=None):
+        samples = samples or {}
+        self.documents = {}
+        for table_name, columns in schema.items():
+            tokens = tokenize(table_name) * TABLE_NAME_WEIGHT
+            for column in columns:
+                tokens += tokenize(column["name"]) * COLUMN_NAME_WEIGHT
+            for value in samples.get(table_name, []):
+                tokens += tokenize(value)
+            self.documents[table_name] = Counter(tokens)
+
+        self.lengths = {table: sum(counts.values()) for table, counts in self.documents.items()}
+        self.average_length = (
+            sum(self.lengths.values()) / len(self.lengths) if self.lengths else 0
+        )
+        document_frequency = Counter()
+        for counts in self.documents.values():
+            document_frequency.update(counts.keys())
+        total = len(self.documents)
+        self.idf = {
+            token: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for token, frequency in document_frequency.items()
+        }
+
+    def search(self, question):
+        """Retourne les tables classées par score BM25 décroissant (scores nuls exclus)."""
+        query_tokens = set(tokenize(question))
+        scores = {}
+        for table_name, counts in self.documents.items():
+            length_ratio = (
+                self.lengths[table_name] / self.average_length if self.average_length else 0
+            )
+            score = 0.0
+            for token in query_tokens:
+                frequency = counts.get(token)
+                if not frequency:
+                    continue
+                score += self.idf[token] * (
+                    frequency
+                    * (BM25_K1 + 1)
+                    / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+                )
+            if score > 0:
+                scores[table_name] = score
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def sample_values(con, schema):
+    """Lit quelques valeurs des colonnes texte de chaque table, pour l'index."""
+    samples = {}
+    for table_name, columns in schema.items():
+        text_columns = [
+            column["name"] for column in columns if column["type"] == "VARCHAR"
+        ][:SCHEMA_SAMPLE_COLUMNS]
+        if not text_columns:
+            continue
+        select_list = ", ".join(
+            f'left("{name}", {SCHEMA_SAMPLE_VALUE_LENGTH})' for name in text_columns
+        )
+        try:
+            rows = con.execute(
+                f'SELECT {select_list} FROM "{table_name}" LIMIT {SCHEMA_SAMPLE_ROWS}'
+            ).fetchall()
+        except Exception as e:
+            print(f"Error sampling values of table '{table_name}': {e}")
+            continue
+        samples[table_name] = [value for row in rows for value in row if value]
+    return samples
+
+
+def get_schema_index(con, schema):
+    """Retourne l'index du schéma, reconstruit seulement quand la version de la base change."""
+    global _index_cache
+    version = database_version()
+    cached = _index_cache
+    if cached is not None and cached["version"] == version and cached["schema"] is schema:
+        return cached["index"]
+    index = SchemaIndex(schema, sample_values(con, schema) if con is not None else None)
+    _index_cache = {"version": version, "schema": schema, "index": index}
+    return index
+
+
+def prune_schema(question, schema, con=None, top_k=SCHEMA_TOP_K, token_budget=SCHEMA_TOKEN_BUDGET):
+    """
+    Ne garde du schéma que les tables les plus pertinentes pour la question : au
+    plus `top_k` tables, classées par BM25, dont la description tient dans
+    `token_budget` tokens, profils de colonnes compris. La table la mieux classée
+    est toujours conservée.
+    """
+    descriptions = {
+        table_name: describe_table(table_name, columns, with_profiles=True)
+        for table_name, columns in schema.items()
+    }
+    total_tokens = sum(estimate_tokens(text) for text in descriptions.values())
+    if len(schema) <= top_k and total_tokens <= token_budget:
+        return schema
+
+    ranking = get_schema_index(con, schema).search(question)
+    ranked_tables = [table_name for table_name, _ in ranking]
+    if not ranked_tables:
+        # Aucun terme commun avec la question : tables dans l'ordre du schéma
+        ranked_tables = list(schema)
+
+    pruned = {}
+    used_tokens = 0
+    for table_name in ranked_tables:
+        if len(pruned) >= top_k:
+            break
+        tokens = estimate_tokens(descriptions[table_name])
+        if pruned and used_tokens + tokens > token_budget:
+            continue
+        pruned[table_name] = schema[table_name]
+        used_tokens += tokens
+
+    print(
+        f"Schéma réduit à {len(pruned)} table(s) sur {len(schema)} "
+        f"(~{used_tokens} tokens) : {list(pruned)}"
+    )
+    return pruned
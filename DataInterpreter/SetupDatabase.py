@@ -3,14 +3,55 @@ import os
 import json
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import re
 import io
+import multiprocessing
+import shutil
+import tempfile
+import time
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
 from PdfExtension import extract_pdf
 from PythonExtension import extract_python
+from ColumnProfiles import profile_tables
+from QueryLog import refresh_materializations
+from Tracing import current_span, traced
+
+from DatabaseConnection import (
+    DATABASE_PATH,
+    bump_database_version,
+    close_database,
+    connect_database,
+)
+from IngestionManifest import (
+    SHADOW_PREFIX,
+    ensure_manifest_table,
+    file_fingerprint,
+    file_status,
+    forget_file,
+    has_manifest_table,
+    load_manifest,
+    manifest_tables,
+    record_ingestion,
+    record_lineage,
+    record_profiles,
+    unprofiled_tables,
+)
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
 
 
 def remove_database_file():
-    database_path = "/app/db/my_database.duckdb"
+    database_path = DATABASE_PATH
+    # Les curseurs partagés sur l'ancien fichier doivent être fermés avant sa suppression
+    close_database()
+    bump_database_version()
     if os.path.exists(database_path):
         os.remove(database_path)
         print(f"Fichier '{database_path}' supprimé avec succès.")
@@ -18,13 +59,83 @@ def remove_database_file():
         print(f"Le fichier '{database_path}' n'existe pas.")
 
 
+# Extensions des classeurs Excel et de tous les fichiers pris en charge par l'ingestion,
+# au démarrage comme pour les fichiers ajoutés ou modifiés ensuite (voir DataWatcher)
+EXCEL_EXTENSIONS = (".xls", ".xlsx", ".xlsm")
+SUPPORTED_EXTENSIONS = (
+    *EXCEL_EXTENSIONS,
+    ".csv",
+    ".json",
+    ".ndjson",
+    ".jsonl",
+    ".parquet",
+    ".pdf",
+    ".py",
+)
+
+# Formats confiés directement aux lecteurs natifs (parallèles) de DuckDB,
+# avec détection automatique du délimiteur et des types de colonnes.
+NATIVE_READERS = {
+    ".csv": "read_csv_auto",
+    ".json": "read_json_auto",
+    ".ndjson": "read_ndjson_auto",
+    ".jsonl": "read_ndjson_auto",
+    ".parquet": "read_parquet",
+}
+
+# Nom de la « feuille » utilisée pour les fichiers ne contenant qu'une table
+NATIVE_SHEET_NAMES = {
+    ".csv": "sheet1",
+    ".json": "main",
+    ".ndjson": "main",
+    ".jsonl": "main",
+    ".parquet": "main",
+}
+
+# Formats chargés par lots au-delà de STREAMING_THRESHOLD_BYTES, à mémoire constante
+STREAMING_EXTENSIONS = (".csv", ".ndjson", ".jsonl")
+STREAMING_THRESHOLD_BYTES = int(os.getenv("STREAMING_THRESHOLD_BYTES", 256 * 1024 * 1024))
+STREAMING_BATCH_ROWS = int(os.getenv("STREAMING_BATCH_ROWS", 100_000))
+
+# Nombre de lignes en tête de fichier utilisées pour inférer le schéma d'un chargement par lots
+STREAMING_SAMPLE_ROWS = int(os.getenv("STREAMING_SAMPLE_ROWS", 2 * STREAMING_BATCH_ROWS))
+# Colonne nommée par DuckDB quand une valeur d'un CSV ne correspond pas au type inféré
+STREAMING_CONVERSION_COLUMN = re.compile(r'Error when converting column "(.*?)"\.')
+
+# Nombre maximal de valeurs examinées pour inférer le type d'une colonne texte
+TYPE_INFERENCE_SAMPLE_SIZE = 1000
+
+# Répertoire où les workers d'ingestion déposent leurs tables au format Parquet
+INGESTION_STAGING_DIR = os.getenv("INGESTION_STAGING_DIR") or None
+
+# Nombre de lignes examinées en tête de feuille Excel pour trouver la ligne d'en-tête
+HEADER_SCAN_ROWS = 20
+
+# Modèle de vision disponible dans les processus du pool d'ingestion
+_worker_ollama_model = None
+
+
 def clean_column_name(column_name):
     return re.sub(r"[^a-zA-Z0-9_]", "_", column_name).lower()
 
-def prepare_database(filepaths=None, ollama_model=None, start=False):
 
-    if filepaths is not None and start == True:
-        remove_database_file()
+def sql_literal(value):
+    """Échappe une valeur pour l'insérer comme chaîne littérale dans une requête SQL."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def build_table_name(filepath, sheet_name):
+    """Construit le nom de table DuckDB associé à une feuille d'un fichier source."""
+    base_table_name = re.sub(
+        r"[^a-zA-Z0-9_]",
+        "_",
+        os.path.splitext(os.path.basename(filepath))[0].strip().lower(),
+    )
+    return f"{base_table_name}_{clean_column_name(str(sheet_name))}"
+
+
+@traced()
+def prepare_database(filepaths=None, ollama_model=None, start=False, workers=1):
 
     all_filepaths = []
     for path in filepaths:
@@ -35,227 +146,1016 @@ def prepare_database(filepaths=None, ollama_model=None, start=False):
         else:
             all_filepaths.append(path)
 
-    conn = duckdb.connect("/app/db/my_database.duckdb")
+    # Seuls les fichiers nouveaux ou modifiés depuis la dernière ingestion sont (re)chargés.
+    # Au démarrage, les fichiers disparus sont aussi retirés et les échecs précédents retentés.
+    all_filepaths, fingerprints = synchronize_with_manifest(
+        filepaths if start == True else None, all_filepaths, retry_failed=start == True
+    )
+
     print(f"Files to be processed: {all_filepaths}")
-    if all_filepaths:
-
-        for filepath in all_filepaths:
-            print(f"Processing file: {filepath}")
-
-            # Déterminer le type de fichier et charger les données
-            data = {}
-            if filepath.endswith(".xls"):
-                print("Loading Excel (.xls) file...")
-                data = pd.read_excel(filepath, sheet_name=None, engine="xlrd")
-            elif filepath.endswith(".xlsx"):
-                print("Loading Excel (.xlsx) file...")
-                data = pd.read_excel(filepath, sheet_name=None, engine="openpyxl")
-            elif filepath.endswith(".xlsm"):
-                print("Loading Excel (.xlsm) file...")
-                data = pd.read_excel(filepath, sheet_name=None, engine="openpyxl")
-            elif filepath.endswith(".csv"):
-                print("Loading CSV file...")
-                data = {"sheet1": pd.read_csv(filepath, sep=";")}
-            elif filepath.endswith(".json"):
-                print("Loading JSON file...")
-                with open(filepath, "r", encoding="utf-8") as f:
-                    json_data = json.load(f)
-                data = {"main": pd.json_normalize(json_data, sep="_")}
-            elif filepath.endswith(".pdf"):
-                print("Processing PDF file...")
-                try:
-                    extracted_text, images_data = extract_pdf(filepath, ollama_model)
+    report = ingest_files(all_filepaths, ollama_model, workers, fingerprints)
+    print_ingestion_report(report)
+    current_span().set(
+        files=len(report),
+        errors=sum(1 for result in report if result["error"]),
+        tables=sum(len(result["tables"]) for result in report),
+        parse_seconds=round(sum(result["parse_seconds"] for result in report), 3),
+        load_seconds=round(sum(result["load_seconds"] for result in report), 3),
+    )
+    profile_existing_tables()
 
-                    # Conversion des données extraites en DataFrame
-                    if extracted_text:
-                        text_json = json.dumps(extracted_text)
-                        text_df = pd.read_json(io.StringIO(text_json))
-                        data["text"] = text_df
+    return connect_database()
 
-                    if images_data:
-                        images_json = json.dumps(images_data)
-                        images_df = pd.read_json(io.StringIO(images_json))
-                        data["images"] = images_df
 
-                except Exception as e:
-                    print(f"Unexpected error processing PDF file '{filepath}': {e}")
-                    continue
-            elif filepath.endswith(".py"):
-                print("Processing Python file...")
-                try:
-                    extracted_data = extract_python(filepath)
-
-                    # Imprimer le contenu complet extrait du fichier Python avant la conversion en DataFrame
-                    print("\n--- Extracted Python Data ---")
-                    print(json.dumps(extracted_data, indent=4, ensure_ascii=False))
-
-                    # Conversion des données extraites en DataFrames distincts
-                    if "functions" in extracted_data and extracted_data["functions"]:
-                        functions_df = pd.DataFrame(extracted_data["functions"])
-                        data["functions"] = functions_df
-                        print("Functions DataFrame created.")
-
-                    if "classes" in extracted_data and extracted_data["classes"]:
-                        classes_df = pd.DataFrame(extracted_data["classes"])
-                        data["classes"] = classes_df
-                        print("Classes DataFrame created.")
-
-                    if "imports" in extracted_data and extracted_data["imports"]:
-                        imports_df = pd.DataFrame(extracted_data["imports"])
-                        data["imports"] = imports_df
-                        print("Imports DataFrame created.")
-
-                    # Ajouter le code brut du module dans un DataFrame
-                    if "module_code" in extracted_data:
-                        module_code_df = pd.DataFrame(
-                            [{"module_code": extracted_data["module_code"]}]
-                        )
-                        data["module_code"] = module_code_df
-                        print("Module code DataFrame created.")
+@traced()
+def profile_existing_tables():
+    """
+    Profile les tables publiées sans profil de colonnes (base créée avant les
+    profils, ou profil en échec) ; les autres ont été profilées à leur ingestion.
+    """
+    conn = connect_database()
+    try:
+        ensure_manifest_table(conn)
+        tables = unprofiled_tables(conn)
+        if not tables:
+            return
+        print(f"Profiling {len(tables)} table(s) without column profiles.")
+        profiles = profile_tables(conn, tables)
+        conn.begin()
+        try:
+            for table_name, table_profiles in profiles.items():
+                record_profiles(conn, table_name, table_profiles)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error recording column profiles: {e}")
+            return
+        bump_database_version(list(profiles))
+    finally:
+        conn.close()
 
-                except Exception as e:
-                    print(f"Unexpected error processing Python file '{filepath}': {e}")
-                    continue
-            else:
-                raise ValueError(
-                    "Le fichier n'est ni un fichier .xls, .xlsx, .xlsm, .csv, .json, .pdf, ni un fichier Python."
-                )
 
-            # Traiter chaque feuille ou table du fichier
-            for sheet_name, df in data.items():
-                base_table_name = re.sub(
-                    r"[^a-zA-Z0-9_]",
-                    "_",
-                    os.path.splitext(os.path.basename(filepath))[0].strip().lower(),
+@traced()
+def synchronize_with_manifest(roots, filepaths, retry_failed=False):
+    """
+    Compare les fichiers à leur entrée du manifeste d'ingestion (taille, date de
+    modification, empreinte) et retourne ceux à (re)charger avec leurs empreintes.
+    Si `roots` est fourni, les tables des fichiers disparus de ces répertoires sont
+    retirées de la base et une base sans manifeste est reconstruite.
+    """
+    conn = connect_database()
+    try:
+        if roots is not None and not has_manifest_table(conn):
+            conn.close()
+            remove_database_file()
+            conn = connect_database()
+        ensure_manifest_table(conn)
+        manifest = load_manifest(conn)
+
+        to_ingest = []
+        fingerprints = {}
+        for filepath in filepaths:
+            path = os.path.abspath(filepath)
+            entry = manifest.get(path)
+            status, fingerprint = file_status(filepath, entry)
+            if status in ("unchanged", "touched") and not (retry_failed and entry["error"]):
+                if status == "touched":
+                    record_ingestion(
+                        conn, path, fingerprint, entry["tables"], entry["error"]
+                    )
+                continue
+            # Les anciennes tables restent en place jusqu'à l'échange atomique
+            if entry is not None:
+                print(f"File {status} since last ingestion: {filepath}")
+            to_ingest.append(filepath)
+            fingerprints[filepath] = fingerprint
+
+        # Fichiers présents dans le manifeste mais disparus des répertoires surveillés
+        present = {os.path.abspath(filepath) for filepath in filepaths}
+        scanned_roots = [os.path.abspath(root) for root in roots or []]
+        for path in manifest:
+            inside_roots = any(
+                path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+                for root in scanned_roots
+            )
+            if inside_roots and path not in present:
+                print(f"File removed since last ingestion: {path}")
+                removed_tables = forget_file(conn, path)
+                bump_database_version(removed_tables)
+                refresh_materializations(conn, removed_tables)
+
+        print(
+            f"{len(filepaths) - len(to_ingest)} file(s) unchanged since last ingestion, "
+            f"{len(to_ingest)} to ingest."
+        )
+        return to_ingest, fingerprints
+    finally:
+        conn.close()
+
+
+@traced()
+def ingest_files(filepaths, ollama_model=None, workers=1, fingerprints=None):
+    """
+    Charge une liste de fichiers dans la base et retourne un rapport par fichier.
+    Avec plusieurs workers, les fichiers qui ne sont pas lus nativement par DuckDB
+    (Excel, PDF, Python...) sont analysés dans un pool de processus et déposés en
+    Parquet dans un répertoire de staging ; une seule connexion DuckDB écrit ensuite
+    ces résultats dans la base. L'échec d'un fichier n'interrompt pas les autres.
+    Les tables de chaque fichier sont construites sous un nom temporaire puis
+    échangées avec les anciennes en une seule transaction (voir publish_result).
+    """
+    fingerprints = fingerprints or {}
+    staged_files = [
+        filepath
+        for filepath in filepaths
+        if os.path.splitext(filepath)[1].lower() not in NATIVE_READERS
+    ]
+    report = []
+
+    if workers <= 1 or len(staged_files) <= 1:
+        conn = connect_database()
+        try:
+            ensure_manifest_table(conn)
+            drop_shadow_tables(conn)
+            for filepath in filepaths:
+                result = ingest_file(
+                    conn, filepath, ollama_model, fingerprints.get(filepath)
                 )
-                table_name = f"{base_table_name}_{clean_column_name(str(sheet_name))}"
-                print(f"Creating table '{table_name}' for sheet '{sheet_name}'.")
+                report.append(publish_result(conn, result))
+            drop_shadow_tables(conn)
+        finally:
+            conn.close()
+        return report
 
-                # Créer la table principale
-                create_table_from_dataframe(conn, df, table_name)
+    staging_dir = tempfile.mkdtemp(prefix="ingestion_", dir=INGESTION_STAGING_DIR)
+    # Les workers sont démarrés par « spawn » : un fork copierait la connexion DuckDB
+    # partagée et les threads du processus (surveillance, file d'ingestion, métriques)
+    executor = ProcessPoolExecutor(
+        max_workers=min(workers, len(staged_files)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_ingestion_worker,
+        initargs=worker_model_spec(ollama_model),
+    )
+    try:
+        futures = {
+            executor.submit(
+                stage_file, filepath, staging_dir, fingerprints.get(filepath)
+            ): filepath
+            for filepath in staged_files
+        }
+        conn = connect_database()
+        try:
+            ensure_manifest_table(conn)
+            drop_shadow_tables(conn)
+            # Les fichiers plats sont chargés par DuckDB pendant que les workers travaillent
+            for filepath in filepaths:
+                if filepath not in staged_files:
+                    result = ingest_file(
+                        conn, filepath, ollama_model, fingerprints.get(filepath)
+                    )
+                    report.append(publish_result(conn, result))
+
+            for future in as_completed(futures):
+                filepath = futures[future]
+                try:
+                    staged = future.result()
+                except Exception as e:
+                    # Le pool lui-même a échoué (processus tué, objet non sérialisable...)
+                    print(f"Worker failed for '{filepath}', ingesting it in-process: {e}")
+                    result = ingest_file(
+                        conn, filepath, ollama_model, fingerprints.get(filepath)
+                    )
+                else:
+                    result = commit_staged_file(conn, staged)
+                report.append(publish_result(conn, result))
+            drop_shadow_tables(conn)
+        finally:
+            conn.close()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return report
+
+
+def publish_result(conn, result):
+    """
+    Remplace, en une seule transaction, les anciennes tables d'un fichier par les
+    tables temporaires qui viennent d'être construites, puis met à jour le manifeste
+    et les catalogues de lignage et de profils de colonnes.
+    Une requête concurrente voit donc soit les anciennes données, soit les nouvelles.
+    En cas d'échec, les anciennes tables sont conservées.
+    """
+    if result["fingerprint"] is None:
+        return result
+
+    shadow_tables = result["tables"]
+    result["tables"] = [table[len(SHADOW_PREFIX):] for table in shadow_tables]
+    # Profils calculés sur les tables temporaires, hors de la transaction d'échange
+    profiles = {} if result["error"] else profile_tables(conn, shadow_tables)
+
+    conn.begin()
+    try:
+        if result["error"]:
+            old_tables = manifest_tables(conn, result["filepath"])
+            record_ingestion(
+                conn, result["filepath"], result["fingerprint"], old_tables, result["error"]
+            )
+            result["tables"] = []
+        else:
+            replaced_tables = forget_file(conn, result["filepath"])
+            for shadow_table, table_name in zip(shadow_tables, result["tables"]):
+                # Un ancien fichier portant le même nom de table est remplacé, jamais complété
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                conn.execute(f"ALTER TABLE {shadow_table} RENAME TO {table_name}")
+            record_lineage(conn, result["filepath"], result["tables"])
+            for shadow_table, table_name in zip(shadow_tables, result["tables"]):
+                record_profiles(conn, table_name, profiles.get(shadow_table, []))
+            record_ingestion(
+                conn, result["filepath"], result["fingerprint"], result["tables"]
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error publishing tables of '{result['filepath']}': {e}")
+        result["tables"] = []
+        result["error"] = str(e)
+        return result
+
+    # Les caches de requêtes et de schéma sont invalidés une fois l'échange validé,
+    # puis les agrégations matérialisées sur ces tables sont reconstruites
+    if not result["error"]:
+        bump_database_version(replaced_tables + result["tables"])
+        refresh_materializations(conn, replaced_tables + result["tables"])
+    return result
+
+
+def drop_shadow_tables(conn):
+    """Supprime les tables temporaires laissées par une ingestion interrompue."""
+    shadow_tables = conn.execute(
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_schema = 'main' AND starts_with(table_name, ?)",
+        [SHADOW_PREFIX],
+    ).fetchall()
+    for (table_name,) in shadow_tables:
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+
+def ingest_file(conn, filepath, ollama_model=None, fingerprint=None):
+    """Charge un fichier dans la base depuis le processus courant."""
+    print(f"Processing file: {filepath}")
+    result = new_ingestion_result(filepath)
+    started = time.perf_counter()
+
+    try:
+        # L'empreinte est relevée avant la lecture pour ne pas manquer une modification concurrente
+        result["fingerprint"] = fingerprint or file_fingerprint(filepath)
+
+        # Les fichiers plats sont lus directement par DuckDB, pandas ne sert
+        # plus que de solution de repli si le lecteur natif échoue.
+        extension = os.path.splitext(filepath)[1].lower()
+        if (
+            extension in STREAMING_EXTENSIONS
+            and os.path.getsize(filepath) > STREAMING_THRESHOLD_BYTES
+        ):
+            # Pas de repli pandas ici : le fichier ne tiendrait pas en mémoire
+            table_name = SHADOW_PREFIX + build_table_name(
+                filepath, NATIVE_SHEET_NAMES[extension]
+            )
+            result["tables"] = stream_file_into_table(conn, filepath, table_name)
+            result["load_seconds"] = time.perf_counter() - started
+            return result
+
+        if extension in NATIVE_READERS:
+            table_name = SHADOW_PREFIX + build_table_name(
+                filepath, NATIVE_SHEET_NAMES[extension]
+            )
+            print(f"Loading {extension} file with DuckDB native reader...")
+            try:
+                result["tables"] = load_file_with_duckdb(conn, filepath, table_name)
+                print(f"Data from '{filepath}' loaded into table '{table_name}'.")
+                result["load_seconds"] = time.perf_counter() - started
+                return result
+            except duckdb.Error as e:
                 print(
-                    f"Base data from '{sheet_name}' loaded into table '{table_name}'."
+                    f"DuckDB native reader failed for '{filepath}', falling back to pandas: {e}"
                 )
 
-                # Gérer les données imbriquées si elles existent
-                handle_nested_data(conn, df, table_name)
+        # Traiter chaque feuille ou table du fichier, au fur et à mesure de sa lecture
+        for sheet_name, df in extract_file_data(filepath, ollama_model):
+            loading_started = time.perf_counter()
+            table_name = SHADOW_PREFIX + build_table_name(filepath, sheet_name)
+            print(f"Creating table '{table_name}' for sheet '{sheet_name}'.")
 
-    return conn
+            # Créer la table principale
+            if create_table_from_dataframe(conn, df, table_name):
+                result["tables"].append(table_name)
+            print(f"Base data from '{sheet_name}' loaded into table '{table_name}'.")
 
-def create_table_from_dataframe(conn, df, table_name):
-    # Déterminer le schéma des colonnes avec des types explicites
-    column_definitions = []
-    for column_name, dtype in df.dtypes.items():
-        column_name_cleaned = clean_column_name(str(column_name))
-        column_type = map_dtype_to_duckdb_type(dtype, df[column_name])
-        column_definitions.append(f'"{column_name_cleaned}" {column_type}')
+            # Gérer les données imbriquées si elles existent
+            result["tables"].extend(handle_nested_data(conn, df, table_name))
+            result["load_seconds"] += time.perf_counter() - loading_started
+    except Exception as e:
+        print(f"Unexpected error processing file '{filepath}': {e}")
+        result["error"] = str(e)
+
+    result["parse_seconds"] = (
+        time.perf_counter() - started - result["load_seconds"]
+    )
+    return result
+
+
+def new_ingestion_result(filepath):
+    """Entrée du rapport d'ingestion pour un fichier."""
+    return {
+        "filepath": filepath,
+        "fingerprint": None,
+        "tables": [],
+        "error": None,
+        "parse_seconds": 0.0,
+        "load_seconds": 0.0,
+    }
+
+
+def print_ingestion_report(report):
+    """Affiche la durée et le résultat de l'ingestion de chaque fichier."""
+    print("--- Ingestion report ---")
+    for result in report:
+        status = f"ERROR: {result['error']}" if result["error"] else "OK"
+        print(
+            f"{result['filepath']}: {status} "
+            f"(parse {result['parse_seconds']:.2f}s, load {result['load_seconds']:.2f}s, "
+            f"tables: {result['tables']})"
+        )
+
+
+def worker_model_spec(ollama_model):
+    """
+    Paramètres du modèle de vision transmis aux workers : sa classe et ses champs
+    plutôt que l'objet lui-même, dont le client HTTP ne peut pas être sérialisé.
+    """
+    if ollama_model is not None and hasattr(ollama_model, "model_dump"):
+        return type(ollama_model), ollama_model.model_dump()
+    return None, ollama_model
 
-    column_definitions_str = ", ".join(column_definitions)
 
-    # Créer la table en DuckDB
-    create_table_query = (
-        f"CREATE TABLE IF NOT EXISTS {table_name} ({column_definitions_str})"
+def init_ingestion_worker(model_class, model_params):
+    """Initialise un processus du pool d'ingestion avec le modèle de vision."""
+    global _worker_ollama_model
+    _worker_ollama_model = (
+        model_params if model_class is None else model_class(**model_params)
     )
+
+
+def stage_file(filepath, staging_dir, fingerprint=None):
+    """
+    Exécuté dans un worker : analyse un fichier, normalise ses tables (y compris
+    les tables filles des données imbriquées) et les écrit en Parquet.
+    """
+    print(f"Staging file: {filepath}")
+    result = new_ingestion_result(filepath)
+    result["staged_tables"] = []
+    started = time.perf_counter()
+
     try:
-        conn.execute(create_table_query)
+        result["fingerprint"] = fingerprint or file_fingerprint(filepath)
+        for sheet_name, df in extract_file_data(filepath, _worker_ollama_model):
+            table_name = SHADOW_PREFIX + build_table_name(filepath, sheet_name)
+            tables = chain([(table_name, df)], extract_nested_tables(df, table_name))
+            for staged_table_name, staged_df in tables:
+                normalized_df, column_types = prepare_dataframe(staged_df)
+                path = os.path.join(staging_dir, f"{uuid.uuid4().hex}.parquet")
+                normalized_df.to_parquet(path, index=False)
+                result["staged_tables"].append(
+                    {
+                        "table_name": staged_table_name,
+                        "column_types": column_types,
+                        "path": path,
+                    }
+                )
     except Exception as e:
-        print(f"Error creating table '{table_name}': {e}")
-        return
+        print(f"Unexpected error staging file '{filepath}': {e}")
+        result["error"] = str(e)
 
-    # Insérer les données par morceaux
-    chunks = np.array_split(df, np.ceil(len(df) / 500))
-    for chunk in chunks:
-        conn.register("temp_chunk", chunk)
-        conn.execute(f"INSERT INTO {table_name} SELECT * FROM temp_chunk")
+    result["parse_seconds"] = time.perf_counter() - started
+    return result
 
 
-def handle_nested_data(conn, df, base_table_name):
-    """Gère les colonnes qui contiennent des données imbriquées (listes ou dictionnaires) de manière dynamique et relationnelle."""
-    for column in df.columns:
-        if df[column].apply(lambda x: isinstance(x, (list, dict))).any():
-            nested_entries = []
-
-            # Chercher un champ clé potentiellement existant dans la table principale
-            parent_key_column = None
-            for col in df.columns:
-                if col.endswith("_id"):
-                    parent_key_column = col
-                    break
-
-            for index, row in df.iterrows():
-                value = row[column]
-                if isinstance(value, list):
-                    for item in value:
-                        if isinstance(item, dict):
-                            if parent_key_column:
-                                item[parent_key_column] = row[parent_key_column]
-                            else:
-                                item["parent_id"] = index
-                            nested_entries.append(item)
-                elif isinstance(value, dict):
-                    if parent_key_column:
-                        value[parent_key_column] = row[parent_key_column]
-                    else:
-                        value["parent_id"] = index
-                    nested_entries.append(value)
-
-            # Créer une table pour les données imbriquées
-            if nested_entries:
-                nested_df = pd.json_normalize(nested_entries, sep="_")
-                nested_table_name = f"{base_table_name}_{clean_column_name(str(column))}"
-                create_table_from_dataframe(conn, nested_df, nested_table_name)
+def commit_staged_file(conn, staged):
+    """Écrit dans la base, en une transaction, les tables préparées par un worker."""
+    result = {key: value for key, value in staged.items() if key != "staged_tables"}
+    if result["error"]:
+        return result
+
+    started = time.perf_counter()
+    conn.begin()
+    try:
+        for table in staged["staged_tables"]:
+            table_name = table["table_name"]
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table_name} AS "
+                f"SELECT {typed_select_list(table['column_types'])} "
+                f"FROM read_parquet({sql_literal(table['path'])})"
+            )
+            result["tables"].append(table_name)
+            print(f"Staged data loaded into table '{table_name}'.")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Error committing staged file '{staged['filepath']}': {e}")
+        result["tables"] = []
+        result["error"] = str(e)
+
+    result["load_seconds"] = time.perf_counter() - started
+    return result
+
+
+def extract_file_data(filepath, ollama_model=None):
+    """
+    Lit un fichier et produit ses feuilles ou tables sous forme de couples
+    (nom, DataFrame), une à la fois, pour que chacune puisse être chargée et
+    libérée avant la lecture de la suivante.
+    """
+    # Déterminer le type de fichier et charger les données
+    if filepath.endswith(EXCEL_EXTENSIONS):
+        print(f"Loading Excel ({os.path.splitext(filepath)[1]}) file...")
+        yield from read_excel_sheets(filepath)
+    elif filepath.endswith(".csv"):
+        print("Loading CSV file...")
+        yield "sheet1", pd.read_csv(filepath, sep=";")
+    elif filepath.endswith(".json"):
+        print("Loading JSON file...")
+        with open(filepath, "r", encoding="utf-8") as f:
+            json_data = json.load(f)
+        yield "main", pd.json_normalize(json_data, sep="_")
+    elif filepath.endswith((".ndjson", ".jsonl")):
+        print("Loading JSON lines file...")
+        with open(filepath, "r", encoding="utf-8") as f:
+            json_data = [json.loads(line) for line in f if line.strip()]
+        yield "main", pd.json_normalize(json_data, sep="_")
+    elif filepath.endswith(".parquet"):
+        print("Loading Parquet file...")
+        yield "main", pd.read_parquet(filepath)
+    elif filepath.endswith(".pdf"):
+        print("Processing PDF file...")
+        extracted_text, images_data = extract_pdf(filepath, ollama_model)
+
+        # Conversion des données extraites en DataFrame
+        if extracted_text:
+            text_json = json.dumps(extracted_text)
+            yield "text", pd.read_json(io.StringIO(text_json))
+
+        if images_data:
+            images_json = json.dumps(images_data)
+            yield "images", pd.read_json(io.StringIO(images_json))
+    elif filepath.endswith(".py"):
+        print("Processing Python file...")
+        extracted_data = extract_python(filepath)
+
+        # Imprimer le contenu complet extrait du fichier Python avant la conversion en DataFrame
+        print("\n--- Extracted Python Data ---")
+        print(json.dumps(extracted_data, indent=4, ensure_ascii=False))
+
+        # Conversion des données extraites en DataFrames distincts
+        if "functions" in extracted_data and extracted_data["functions"]:
+            print("Functions DataFrame created.")
+            yield "functions", pd.DataFrame(extracted_data["functions"])
+
+        if "classes" in extracted_data and extracted_data["classes"]:
+            print("Classes DataFrame created.")
+            yield "classes", pd.DataFrame(extracted_data["classes"])
+
+        if "imports" in extracted_data and extracted_data["imports"]:
+            print("Imports DataFrame created.")
+            yield "imports", pd.DataFrame(extracted_data["imports"])
+
+        # Ajouter le code brut du module dans un DataFrame
+        if "module_code" in extracted_data:
+            print("Module code DataFrame created.")
+            yield "module_code", pd.DataFrame(
+                [{"module_code": extracted_data["module_code"]}]
+            )
+    else:
+        raise ValueError(
+            "Le fichier n'est ni un fichier .xls, .xlsx, .xlsm, .csv, .json, .ndjson, .jsonl, .parquet, .pdf, ni un fichier Python."
+        )
+
+
+def excel_engine(filepath):
+    """Choisit le moteur de lecture Excel : calamine s'il est installé, sinon openpyxl ou xlrd."""
+    if python_calamine is not None:
+        return "calamine"
+    return "xlrd" if filepath.endswith(".xls") else "openpyxl"
+
+
+def visible_sheet_names(workbook, engine):
+    """Retourne les noms des feuilles visibles d'un classeur ouvert avec pd.ExcelFile."""
+    try:
+        if engine == "calamine":
+            return [
+                sheet.name
+                for sheet in workbook.book.sheets_metadata
+                if sheet.visible == python_calamine.SheetVisibleEnum.Visible
+            ]
+        if engine == "openpyxl":
+            return [
+                sheet.title
+                for sheet in workbook.book.worksheets
+                if sheet.sheet_state == "visible"
+            ]
+        if engine == "xlrd":
+            return [
+                sheet.name for sheet in workbook.book.sheets() if sheet.visibility == 0
+            ]
+    except AttributeError as e:
+        print(f"Sheet visibility unavailable, reading every sheet: {e}")
+    return workbook.sheet_names
+
+
+def read_excel_sheets(filepath):
+    """
+    Lit un classeur Excel feuille par feuille (le classeur n'est ouvert qu'une fois).
+    Les feuilles masquées ou vides sont ignorées et la ligne d'en-tête réelle est
+    détectée, au lieu de supposer qu'il s'agit de la première ligne.
+    """
+    engine = excel_engine(filepath)
+    with pd.ExcelFile(filepath, engine=engine) as workbook:
+        sheet_names = visible_sheet_names(workbook, engine)
+        skipped = set(workbook.sheet_names) - set(sheet_names)
+        if skipped:
+            print(f"Skipping hidden sheets: {sorted(skipped)}")
+
+        for sheet_name in sheet_names:
+            raw = workbook.parse(sheet_name, header=None)
+            raw = raw.dropna(how="all").dropna(axis=1, how="all")
+            if raw.empty:
+                print(f"Skipping empty sheet '{sheet_name}'.")
+                continue
+
+            header_row = detect_header_row(raw)
+            yield sheet_name, apply_header_row(raw, header_row)
+
+
+def detect_header_row(raw):
+    """
+    Retourne la position de la ligne d'en-tête : la première ligne, parmi les
+    HEADER_SCAN_ROWS premières, qui ne contient que du texte et remplit presque
+    toutes les colonnes utilisées. Un titre ou des notes placés au-dessus du
+    tableau sont ainsi écartés. À défaut, la première ligne non vide est retenue.
+    """
+    scan = raw.head(HEADER_SCAN_ROWS)
+    filled = scan.notna().sum(axis=1).to_numpy()
+    min_filled = max(1, int(np.ceil(0.8 * filled.max())))
+    for position, row in enumerate(scan.itertuples(index=False)):
+        values = [value for value in row if pd.notna(value)]
+        if filled[position] >= min_filled and all(isinstance(v, str) for v in values):
+            return position
+    return 0
+
+
+def apply_header_row(raw, header_row):
+    """Utilise une ligne comme en-tête et retourne les lignes suivantes avec leurs types restaurés."""
+    columns = []
+    for index, value in enumerate(raw.iloc[header_row]):
+        name = str(value).strip() if pd.notna(value) else f"column_{index}"
+        # Les noms en double reçoivent un suffixe, comme le fait pandas
+        candidate, suffix = name, 1
+        while candidate in columns:
+            candidate, suffix = f"{name}_{suffix}", suffix + 1
+        columns.append(candidate)
+
+    df = raw.iloc[header_row + 1 :].reset_index(drop=True)
+    df.columns = columns
+    return df.infer_objects()
+
+
+def load_file_with_duckdb(conn, filepath, table_name):
+    """
+    Charge un fichier CSV, JSON ou Parquet sans passer par pandas.
+    Les colonnes STRUCT sont aplaties en colonnes « parent_enfant » (comme pd.json_normalize)
+    et les listes d'objets sont extraites dans des tables filles.
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    source = f"{NATIVE_READERS[extension]}({sql_literal(filepath)})"
+
+    relation = conn.sql(f"SELECT * FROM {source}")
+    select_list = ", ".join(
+        flatten_struct_columns(
+            [f'"{name}"' for name in relation.columns],
+            [clean_column_name(str(name)) for name in relation.columns],
+            relation.types,
+        )
+    )
+
+    # Une seule transaction : en cas d'échec, rien n'est laissé pour le repli pandas
+    conn.begin()
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT {select_list} FROM {source}"
+        )
+        nested_tables = handle_nested_table(conn, table_name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [table_name, *nested_tables]
+
+
+def stream_file_into_table(conn, filepath, table_name):
+    """
+    Charge un gros fichier CSV ou NDJSON par lots de STREAMING_BATCH_ROWS lignes.
+    Le schéma est inféré sur les STREAMING_SAMPLE_ROWS premières lignes, puis chaque
+    lot lu par DuckDB est ajouté à la table dès sa réception : la mémoire utilisée
+    ne dépend pas de la taille du fichier.
+    Une valeur située après l'échantillon et incompatible avec le type inféré fait
+    reprendre le chargement depuis le début : la colonne fautive d'un CSV est relue
+    en VARCHAR, sinon les types sont inférés sur tout le fichier.
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    varchar_columns = []
+    full_sample = False
+    while True:
+        source = streaming_source(filepath, extension, varchar_columns, full_sample)
+        try:
+            return stream_source_into_table(conn, filepath, source, table_name)
+        except (duckdb.ConversionException, duckdb.InvalidInputException) as e:
+            match = STREAMING_CONVERSION_COLUMN.search(str(e))
+            column_name = match.group(1) if match else None
+            if extension == ".csv" and column_name and column_name not in varchar_columns:
+                varchar_columns.append(column_name)
                 print(
-                    f"Nested data from '{column}' loaded into table '{nested_table_name}'."
+                    f"Column '{column_name}' of '{filepath}' does not match the type inferred "
+                    f"from the first rows, reloading it as VARCHAR."
                 )
+            elif not full_sample:
+                full_sample = True
+                print(
+                    f"'{filepath}' does not match the types inferred from the first rows, "
+                    f"reloading it with types inferred from the whole file."
+                )
+            else:
+                raise
 
 
-def map_dtype_to_duckdb_type(dtype, column_data):
-    """Mappe le type de données Pandas au type de données DuckDB avec vérification des valeurs."""
-    if np.issubdtype(dtype, np.integer):
-        return "INTEGER"
-    elif np.issubdtype(dtype, np.floating):
-        return "DOUBLE"
-    elif np.issubdtype(dtype, np.bool_):
-        return "BOOLEAN"
-    elif np.issubdtype(dtype, np.datetime64):
-        return "TIMESTAMP"
-    elif dtype == object:
-        # Vérifier si les données sont des chiffres, des booléens ou des dates même si elles sont considérées comme 'object'
-        if column_data.apply(lambda x: isinstance(x, bool)).all():
-            return "BOOLEAN"
-        elif column_data.apply(lambda x: is_float(x)).all():
-            return "DOUBLE"
-        elif column_data.apply(lambda x: is_integer(x)).all():
-            return "INTEGER"
-        elif column_data.apply(lambda x: is_date(x)).all():
-            return "TIMESTAMP"
+def streaming_source(filepath, extension, varchar_columns=(), full_sample=False):
+    """Appel du lecteur DuckDB d'un fichier chargé par lots."""
+    sample_size = -1 if full_sample else STREAMING_SAMPLE_ROWS
+    if extension == ".csv":
+        source = f"read_csv({sql_literal(filepath)}, sample_size={sample_size}"
+        if varchar_columns:
+            types = ", ".join(f"{sql_literal(name)}: 'VARCHAR'" for name in varchar_columns)
+            source += f", types={{{types}}}"
+        return source + ")"
+    return (
+        f"read_json({sql_literal(filepath)}, format='newline_delimited', "
+        f"sample_size={sample_size})"
+    )
+
+
+def stream_source_into_table(conn, filepath, source, table_name):
+    """Crée la table à partir du schéma de `source`, puis y ajoute ses lignes lot par lot."""
+    # Lecture et écriture passent par deux connexions distinctes à la même base
+    reader = conn.cursor()
+    try:
+        relation = reader.sql(f"SELECT * FROM {source}")
+        select_list = ", ".join(
+            flatten_struct_columns(
+                [f'"{name}"' for name in relation.columns],
+                [clean_column_name(str(name)) for name in relation.columns],
+                relation.types,
+            )
+        )
+        query = f"SELECT {select_list} FROM {source}"
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} AS {query} LIMIT 0")
+
+        total_bytes = os.path.getsize(filepath)
+        print(
+            f"Streaming '{filepath}' ({total_bytes / 1024 / 1024:.0f} MB) "
+            f"into '{table_name}' by batches of {STREAMING_BATCH_ROWS} rows..."
+        )
+        result = reader.execute(query)
+        if hasattr(result, "to_arrow_reader"):
+            batches = result.to_arrow_reader(STREAMING_BATCH_ROWS)
+        else:
+            batches = result.fetch_record_batch(STREAMING_BATCH_ROWS)
+
+        started = time.perf_counter()
+        loaded_rows = 0
+        for batch in batches:
+            conn.register("stream_batch", pa.Table.from_batches([batch]))
+            conn.execute(f"INSERT INTO {table_name} SELECT * FROM stream_batch")
+            conn.unregister("stream_batch")
+            loaded_rows += batch.num_rows
+            elapsed = time.perf_counter() - started
+            print(
+                f"{loaded_rows} rows loaded into '{table_name}' "
+                f"({loaded_rows / max(elapsed, 1e-6):.0f} rows/s)"
+            )
+    except Exception:
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        raise
+    finally:
+        reader.close()
+
+    return [table_name, *handle_nested_table(conn, table_name)]
+
+
+def flatten_struct_columns(expressions, names, types):
+    """Construit la liste de sélection SQL qui aplatit récursivement les colonnes STRUCT."""
+    select_list = []
+    for expression, name, column_type in zip(expressions, names, types):
+        if column_type.id == "struct":
+            children = column_type.children
+            select_list.extend(
+                flatten_struct_columns(
+                    [f'{expression}."{child}"' for child, _ in children],
+                    [f"{name}_{clean_column_name(str(child))}" for child, _ in children],
+                    [child_type for _, child_type in children],
+                )
+            )
         else:
-            return "TEXT"
+            select_list.append(f'{expression} AS "{name}"')
+    return select_list
+
+
+def handle_nested_table(conn, table_name, inherited_key=None):
+    """Extrait récursivement les colonnes de listes d'objets d'une table DuckDB dans des tables filles."""
+    relation = conn.table(table_name)
+    nested_tables = []
+
+    # Même clé parente que extract_nested_tables : première colonne « _id » propre, sinon la position
+    parent_key_column = next(
+        (
+            col
+            for col in relation.columns
+            if col.endswith("_id") and col != inherited_key
+        ),
+        None,
+    )
+    if parent_key_column:
+        parent_key_name, parent_key_select = parent_key_column, f'"{parent_key_column}"'
     else:
-        return "TEXT"
+        # rowid n'est pas encore définitif dans la transaction qui crée la table
+        parent_key_name = "parent_id"
+        parent_key_select = "row_number() OVER (ORDER BY rowid) - 1 AS parent_id"
 
+    for column, column_type in zip(relation.columns, relation.types):
+        if column_type.id != "list":
+            continue
+        item_type = column_type.children[0][1]
+        if item_type.id != "struct":
+            continue
 
-def is_float(value):
-    """Vérifie si une valeur peut être convertie en float."""
-    try:
-        float(value)
-        return True
-    except (ValueError, TypeError):
-        return False
+        # La clé parente remplace un éventuel champ homonyme des éléments
+        item_children = [
+            (child, child_type)
+            for child, child_type in item_type.children
+            if clean_column_name(str(child)) != parent_key_name
+        ]
+        item_columns = flatten_struct_columns(
+            [f'item."{child}"' for child, _ in item_children],
+            [clean_column_name(str(child)) for child, _ in item_children],
+            [child_type for _, child_type in item_children],
+        )
+        nested_table_name = f"{table_name}_{clean_column_name(str(column))}"
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {nested_table_name} AS "
+            f'SELECT {", ".join(item_columns)}, "{parent_key_name}" '
+            f'FROM (SELECT {parent_key_select}, UNNEST("{column}") AS item FROM {table_name})'
+        )
+        print(f"Nested data from '{column}' loaded into table '{nested_table_name}'.")
+        nested_tables.append(nested_table_name)
 
+        # Les listes d'objets contenues dans la table fille donnent des tables petites-filles
+        nested_tables.extend(
+            handle_nested_table(conn, nested_table_name, parent_key_name)
+        )
+    return nested_tables
 
-def is_integer(value):
-    """Vérifie si une valeur peut être convertie en entier."""
-    try:
-        return float(value).is_integer()
-    except (ValueError, TypeError):
-        return False
 
+def create_table_from_dataframe(conn, df, table_name):
+    """
+    Crée la table à partir du DataFrame en une seule instruction CREATE TABLE AS :
+    le DataFrame est exposé à DuckDB sous forme de table Arrow (sans copie pour les
+    colonnes numériques) et chaque colonne est convertie vers le type inféré.
+    """
+    # Déterminer le schéma des colonnes avec des types explicites
+    df, column_types = prepare_dataframe(df)
+    try:
+        source = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, TypeError, ValueError):
+        # Colonnes que pyarrow ne sait pas convertir : DuckDB lit alors le DataFrame directement
+        source = df
 
-def is_date(value):
-    """Vérifie si une valeur est une date."""
     try:
-        pd.to_datetime(value)
-        return True
-    except (ValueError, TypeError):
+        conn.register("temp_dataframe", source)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table_name} AS "
+            f"SELECT {typed_select_list(column_types)} FROM temp_dataframe"
+        )
+    except Exception as e:
+        print(f"Error creating table '{table_name}': {e}")
         return False
+    finally:
+        conn.unregister("temp_dataframe")
+    return True
+
+
+def typed_select_list(column_types):
+    """Construit la liste de sélection qui convertit chaque colonne vers son type DuckDB."""
+    return ", ".join(
+        f'CAST("{column_name}" AS {column_type}) AS "{column_name}"'
+        for column_name, column_type in column_types
+    )
+
+
+def prepare_dataframe(df):
+    """
+    Infère le type DuckDB de chaque colonne et retourne une copie du DataFrame
+    dont les colonnes sont renommées et converties vers ces types, avec la liste
+    des couples (nom de colonne, type DuckDB) correspondants.
+    """
+    columns = {}
+    column_types = []
+    for position, (column_name, dtype) in enumerate(df.dtypes.items()):
+        # Deux en-têtes peuvent donner le même nom nettoyé (« A b » et « a_b ») :
+        # chaque colonne source garde ses données sous un nom suffixé
+        name = clean_column_name(str(column_name))
+        column_name_cleaned, suffix = name, 1
+        while column_name_cleaned in columns:
+            column_name_cleaned, suffix = f"{name}_{suffix}", suffix + 1
+        column_data = df.iloc[:, position]
+        column_type, rule = infer_column_type(dtype, column_data)
+        print(f"Column '{column_name_cleaned}' typed as {column_type} (rule: {rule}).")
+        column_types.append((column_name_cleaned, column_type))
+        columns[column_name_cleaned] = normalize_column(column_data, column_type)
+
+    return pd.DataFrame(columns, index=df.index), column_types
+
+
+def normalize_column(column_data, column_type):
+    """Convertit une colonne texte vers le type DuckDB retenu pour elle."""
+    if column_data.dtype != object and not pd.api.types.is_string_dtype(column_data.dtype):
+        return column_data
+    if column_type in ("INTEGER", "BIGINT"):
+        return pd.to_numeric(column_data, errors="coerce").astype("Int64")
+    if column_type == "DOUBLE":
+        return pd.to_numeric(column_data, errors="coerce")
+    if column_type == "TIMESTAMP":
+        return parse_datetimes(column_data)
+    if column_type == "BOOLEAN":
+        return column_data.astype("boolean")
+    if column_data.dtype == object:
+        # Listes, dictionnaires et valeurs hétérogènes sont stockés sous forme de texte
+        return column_data.where(column_data.isna(), column_data.astype(str))
+    return column_data
+
+
+def handle_nested_data(conn, df, base_table_name):
+    """Gère les colonnes qui contiennent des données imbriquées (listes ou dictionnaires) de manière dynamique et relationnelle."""
+    nested_tables = []
+    for nested_table_name, nested_df in extract_nested_tables(df, base_table_name):
+        if create_table_from_dataframe(conn, nested_df, nested_table_name):
+            nested_tables.append(nested_table_name)
+        print(f"Nested data loaded into table '{nested_table_name}'.")
+    return nested_tables
+
+
+def extract_nested_tables(df, base_table_name, inherited_key=None):
+    """
+    Construit les DataFrames des tables filles issues des colonnes imbriquées, de
+    manière vectorisée et récursive : chaque liste est éclatée avec explode, les
+    dictionnaires sont aplatis en un seul appel à json_normalize et les colonnes
+    imbriquées des tables filles produisent à leur tour des tables petites-filles.
+    La clé parente est la première colonne « _id » propre à la table parente (la
+    clé héritée de son propre parent n'identifie pas ses lignes), sinon
+    « parent_id », la position de la ligne parente dans sa table.
+    """
+    parent_key_column = next(
+        (
+            col
+            for col in df.columns
+            if str(col).endswith("_id") and col != inherited_key
+        ),
+        None,
+    )
+    if parent_key_column is not None:
+        parent_key_name = parent_key_column
+        parent_keys = df[parent_key_column].to_numpy()
+    else:
+        parent_key_name = "parent_id"
+        parent_keys = np.arange(len(df))
+
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            continue
+        value_types = values.map(type)
+        is_dict = (value_types == dict).to_numpy()
+        is_list = (value_types == list).to_numpy()
+        if not (is_dict.any() or is_list.any()):
+            continue
+
+        # Les positions des lignes parentes suivent chaque élément extrait
+        positional = values.reset_index(drop=True)
+        items = pd.concat(
+            [positional[is_dict], positional[is_list].explode()]
+        ).sort_index(kind="stable")
+        items = items[(items.map(type) == dict).to_numpy()]
+        if items.empty:
+            continue
+
+        nested_df = pd.json_normalize(items.tolist(), sep="_")
+        nested_df[parent_key_name] = parent_keys[items.index.to_numpy()]
+
+        nested_table_name = f"{base_table_name}_{clean_column_name(str(column))}"
+        yield nested_table_name, nested_df
+        yield from extract_nested_tables(nested_df, nested_table_name, parent_key_name)
+
+
+def infer_column_type(dtype, column_data):
+    """
+    Détermine le type DuckDB d'une colonne et la règle qui l'a choisi.
+    Les colonnes texte sont analysées sur un échantillon borné avec des conversions
+    vectorisées ; la colonne entière n'est revalidée que si l'échantillon propose
+    un type plus précis que TEXT.
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN", "dtype:bool"
+    elif pd.api.types.is_integer_dtype(dtype):
+        return integer_type(column_data), "dtype:integer"
+    elif pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE", "dtype:float"
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP", "dtype:datetime"
+    elif dtype != object and not pd.api.types.is_string_dtype(dtype):
+        return "TEXT", "dtype:other"
+
+    values = column_data.dropna()
+    if values.empty:
+        return "TEXT", "empty"
+
+    sample = values
+    if len(values) > TYPE_INFERENCE_SAMPLE_SIZE:
+        positions = np.linspace(0, len(values) - 1, TYPE_INFERENCE_SAMPLE_SIZE)
+        sample = values.iloc[positions.astype(int)]
+
+    column_type, rule = classify_values(sample)
+    if column_type == "TEXT" or len(sample) == len(values):
+        return column_type, f"sample:{rule}"
+
+    # L'échantillon est ambigu : seule la colonne entière peut confirmer le type
+    column_type, rule = classify_values(values, candidate=column_type)
+    return column_type, f"full:{rule}"
+
+
+def classify_values(values, candidate=None):
+    """
+    Applique les règles d'inférence (booléen, nombre, date) à des valeurs non nulles.
+    Si `candidate` est fourni, seule la règle correspondante est vérifiée.
+    """
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+
+    if candidate in (None, "BOOLEAN") and inferred == "boolean":
+        return "BOOLEAN", "boolean"
+
+    if candidate in (None, "INTEGER", "BIGINT", "DOUBLE"):
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.notna().all() and inferred != "boolean":
+            if (numeric % 1 == 0).all():
+                return integer_type(numeric), "numeric:integer"
+            return "DOUBLE", "numeric:float"
+
+    if candidate in (None, "TIMESTAMP") and inferred not in ("integer", "floating", "boolean"):
+        try:
+            dates = parse_datetimes(values)
+        except (ValueError, TypeError):
+            # Valeurs que pandas refuse de convertir ensemble : la colonne reste du texte
+            dates = None
+        if dates is not None and dates.notna().all():
+            return "TIMESTAMP", "datetime"
+
+    return "TEXT", "text" if candidate is None else f"text:rejected-{candidate.lower()}"
+
+
+def parse_datetimes(values):
+    """
+    Convertit des valeurs texte en dates (valeurs invalides : NaT). Des dates avec
+    des décalages horaires différents (heure d'été, +01:00 et +02:00) sont ramenées
+    en UTC, sans fuseau, au lieu d'être refusées par pandas.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            return pd.to_datetime(values, errors="coerce")
+        except (ValueError, TypeError):
+            return pd.to_datetime(values, errors="coerce", utc=True).dt.tz_localize(None)
+
+
+def integer_type(values):
+    """Choisit INTEGER ou BIGINT selon l'amplitude des valeurs."""
+    if values.empty:
+        return "INTEGER"
+    if values.min() < -(2**31) or values.max() > 2**31 - 1:
+        return "BIGINT"
+    return "INTEGER"
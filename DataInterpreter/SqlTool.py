@@ -1,59 +1,735 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import duckdb
+import pyarrow as pa
+from DatabaseConnection import (
+    bump_database_version,
+    database_version,
+    pooled_cursor,
+    thread_cursor,
+)
+from IngestionManifest import SHADOW_PREFIX, load_profiles
+from QueryCache import (
+    QueryResultCache,
+    is_deterministic_query,
+    normalize_sql,
+    query_tables,
+)
+from QueryLog import (
+    QueryLog,
+    is_aggregate_query,
+    is_hot,
+    materialize_query,
+    materialized_table,
+)
+from Tracing import current_span, traced
+
+# Limites d'un résultat de requête : au-delà, seul un aperçu est conservé avec le nombre total de lignes
+SQL_RESULT_MAX_ROWS = int(os.getenv("SQL_RESULT_MAX_ROWS", 10_000))
+SQL_RESULT_MAX_BYTES = int(os.getenv("SQL_RESULT_MAX_BYTES", 16 * 1024 * 1024))
+
+# Durée maximale d'une requête, lecture du résultat comprise, en secondes (0 : sans limite).
+# La mémoire et les threads se règlent pour toute la base (DUCKDB_MEMORY_LIMIT, DUCKDB_THREADS) :
+# DuckDB n'accepte pas ces paramètres par connexion.
+SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", 60))
+
+# Nombre de lectures d'une même requête exécutées en parallèle, chacune sur un curseur du pool
+SQL_BATCH_WORKERS = int(os.getenv("SQL_BATCH_WORKERS", 4))
+
+# Instructions sans effet de bord, exécutées en parallèle et mises en cache
+# (SHOW, DESCRIBE, SUMMARIZE, PIVOT... sont aussi des SELECT pour DuckDB)
+READ_STATEMENT_TYPES = (duckdb.StatementType.SELECT,)
+
+# Instructions qui ne modifient aucune table de la base : réglages, transactions,
+# lectures et préparation, sans effet sur les résultats en cache
+NON_MODIFYING_STATEMENT_TYPES = (
+    duckdb.StatementType.SELECT,
+    duckdb.StatementType.SET,
+    duckdb.StatementType.VARIABLE_SET,
+    duckdb.StatementType.PRAGMA,
+    duckdb.StatementType.TRANSACTION,
+    duckdb.StatementType.EXPLAIN,
+    duckdb.StatementType.PREPARE,
+    duckdb.StatementType.LOAD,
+)
+
+# Nom de table éventuellement qualifié, identifiants protégés ou non
+TABLE_NAME = r'(?P<table>(?:"(?:[^"]|"")+"|[\w$]+)(?:\s*\.\s*(?:"(?:[^"]|"")+"|[\w$]+))*)'
+TABLE_NAME_PART = re.compile(r'"((?:[^"]|"")+)"|([\w$]+)')
+
+# Table modifiée par chaque type d'instruction, lue dans la requête normalisée
+MODIFIED_TABLE_PATTERNS = {
+    duckdb.StatementType.INSERT: re.compile(
+        r"\binsert\s+(?:or\s+(?:replace|ignore)\s+)?into\s+" + TABLE_NAME
+    ),
+    duckdb.StatementType.UPDATE: re.compile(r"\bupdate\s+" + TABLE_NAME),
+    duckdb.StatementType.DELETE: re.compile(r"\bdelete\s+from\s+" + TABLE_NAME),
+    duckdb.StatementType.COPY: re.compile(r"^copy\s+" + TABLE_NAME + r"\s*(?:\([^)]*\)\s*)?from\b"),
+}
+# COPY ... TO : export vers un fichier, sans modification de la base
+COPY_TO_PATTERN = re.compile(r"^copy\b.*\bto\b", re.DOTALL)
+for _statement_type in (
+    duckdb.StatementType.CREATE,
+    duckdb.StatementType.DROP,
+    duckdb.StatementType.ALTER,
+):
+    MODIFIED_TABLE_PATTERNS[_statement_type] = re.compile(
+        r"^(?:create|drop|alter)\s+(?:or\s+replace\s+)?(?P<temporary>temp\s+|temporary\s+)?"
+        r"(?:table|view)\s+(?:if\s+(?:not\s+)?exists\s+)?" + TABLE_NAME
+    )
+
+# Schémas des tables temporaires, propres à la connexion et jamais mises en cache
+TEMPORARY_SCHEMAS = ("temp", "temporary")
+
+# Taille des lots Arrow lus depuis DuckDB
+SQL_RESULT_BATCH_ROWS = 2048
+
+# Nombre de lignes d'un résultat affichées dans les logs
+SQL_RESULT_LOG_ROWS = 10
+
+# Préfixe qui fait analyser et lier une instruction par DuckDB sans l'exécuter
+EXPLAIN_PREFIX = "EXPLAIN "
+
+# Contexte ajouté par DuckDB à ses messages d'erreur : ligne fautive et curseur sous la position
+ERROR_CONTEXT_PATTERN = re.compile(r"\n\nLINE (\d+): (.*)\n( *)\^\s*$")
 
+# Résultats des requêtes de lecture, réutilisés tant que les tables lues n'ont pas changé
+query_cache = QueryResultCache()
 
-def execute_sql_query(query):
+# Fréquence et durée des lectures, pour matérialiser les agrégations fréquentes et coûteuses
+query_log = QueryLog()
+
+# Dernier schéma lu par get_schema, avec la version de la base à laquelle il a été lu
+schema_cache = None
+
+
+@traced()
+def execute_sql_batch(
+    query,
+    result_format="records",
+    max_rows=SQL_RESULT_MAX_ROWS,
+    max_bytes=SQL_RESULT_MAX_BYTES,
+    timeout=SQL_QUERY_TIMEOUT_SECONDS,
+):
     """
-    Exécute une requête SQL sur une base DuckDB et retourne les résultats formatés.
+    Exécute une suite d'instructions SQL, découpée par l'analyseur de DuckDB, et
+    retourne une entrée par instruction : requête, type d'instruction, durée,
+    résultat formaté (ou None), erreur structurée (ou None, voir query_error),
+    indication de mise en cache et d'annulation.
+    Chaque résultat est limité à `max_rows` lignes et `max_bytes` octets et retourné
+    sous forme de dictionnaire contenant les colonnes, l'aperçu (`data`), le nombre
+    total de lignes et l'indication de troncature. L'aperçu est une liste de
+    dictionnaires avec `result_format="records"`, une table Arrow ou un DataFrame
+    avec « arrow » ou « dataframe ». Une instruction qui dépasse `timeout` secondes est interrompue.
+    Une suite de lectures est exécutée en parallèle sur des curseurs du pool. Dès
+    qu'une instruction modifie la base, toute la suite est exécutée dans l'ordre,
+    dans une seule transaction : une instruction en échec annule les précédentes
+    et les suivantes ne sont pas exécutées.
     """
+    print(f"Exécution de la requête SQL : {query}")
+    started = time.perf_counter()
     try:
-        print(f"Exécution de la requête SQL : {query}")
-        connection = duckdb.connect("my_database.duckdb")
+        with pooled_cursor() as connection:
+            statements = connection.extract_statements(query)
+    except duckdb.Error as e:
+        error = located_query_error(e, query.strip(), time.perf_counter() - started)
+        print(f"Erreur lors de l'analyse de la requête SQL : {error}")
+        return [statement_entry(query.strip(), None, time.perf_counter() - started, error=error)]
 
-        queries = query.strip().split(";")
-        all_results = []
+    if all(statement.type in READ_STATEMENT_TYPES for statement in statements):
+        entries = run_read_statements(statements, max_rows, max_bytes, timeout)
+    else:
+        entries = run_write_statements(statements, max_rows, max_bytes, timeout)
+
+    current_span().set(
+        statements=len(entries),
+        rows=sum(entry["result"]["row_count"] for entry in entries if entry["result"] is not None),
+        errors=sum(1 for entry in entries if entry["error"]),
+        cached=sum(1 for entry in entries if entry["cached"]),
+        materialized=sum(1 for entry in entries if entry["materialized"]),
+    )
+    for entry in entries:
+        if entry["result"] is not None:
+            entry["result"] = format_result(entry["result"], result_format)
+    return entries
+
+
+def statement_entry(query, statement_type, elapsed_seconds, result=None, error=None, cached=False):
+    """Entrée retournée par execute_sql_batch pour une instruction."""
+    return {
+        "query": query,
+        "statement_type": statement_type,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "result": result,
+        "error": error,
+        "cached": cached,
+        "materialized": False,
+        "rolled_back": False,
+    }
 
-        for query in queries:
-            try:
-                if query.strip():
-                    # Exécution de la requête SQL
-                    cursor = connection.execute(query)
-                    results = cursor.fetchall()
-                    # Récupération des noms de colonnes
-                    column_names = [desc[0] for desc in cursor.description]
-                    # Formatage des résultats sous forme de liste de dictionnaires
-                    formatted_results = [dict(zip(column_names, row)) for row in results]
-                    print(f"Résultats de la requête SQL : {formatted_results}")
-                    all_results.append(formatted_results)
-            except Exception as e:
-                print(f"Erreur lors de l'exécution de la requête suivante : {query}\n{e}")
-        return all_results
 
+@traced("sql.statement")
+def run_statement(connection, query, max_rows, max_bytes, timeout, statement_type="SELECT"):
+    """
+    Exécute une instruction sur un curseur, interrompue par DuckDB au-delà de
+    `timeout` secondes, et retourne son entrée avec le résultat borné ou l'erreur.
+    """
+    timer = threading.Timer(timeout, connection.interrupt) if timeout else None
+    started = time.perf_counter()
+    if timer:
+        timer.start()
+    try:
+        cursor = connection.execute(query)
+        result = None
+        if cursor.description is not None:
+            result = fetch_bounded_result(cursor, max_rows, max_bytes)
     except Exception as e:
-        print(f"Erreur lors de l'exécution de la requête SQL : {e}")
+        timed_out = timer is not None and timer.finished.is_set()
+        error = query_error(e, query, time.perf_counter() - started, timeout if timed_out else None)
+        print(f"Erreur lors de l'exécution de la requête suivante : {query}\n{error}")
+        current_span().set(statement_type=statement_type, error_kind=error["error"])
+        return statement_entry(
+            query, statement_type, time.perf_counter() - started, error=error
+        )
+    finally:
+        if timer:
+            timer.cancel()
+
+    elapsed = time.perf_counter() - started
+    current_span().set(
+        statement_type=statement_type, rows=result["row_count"] if result is not None else 0
+    )
+    if result is None:
+        print(f"Instruction exécutée en {elapsed:.3f} s, aucun résultat retourné.")
+    else:
+        print(f"Résultats de la requête SQL ({elapsed:.3f} s) :")
+        print_result(result)
+    return statement_entry(query, statement_type, elapsed, result=result)
+
+
+def run_read_statement(statement, max_rows, max_bytes, timeout):
+    """
+    Exécute une lecture sur un curseur du pool, ou la sert depuis le cache ou
+    depuis la table matérialisée d'une agrégation fréquente. Une lecture dont le
+    résultat dépend de l'heure ou du hasard (voir is_deterministic_query) est
+    toujours exécutée.
+    """
+    query = statement.query.strip()
+    normalized_query = normalize_sql(query)
+    cache_key = (normalized_query, max_rows, max_bytes)
+    with pooled_cursor() as connection:
+        reusable = is_deterministic_query(connection, query)
+        cached_result = query_cache.get(cache_key) if reusable else None
+        if cached_result is not None:
+            query_log.record(normalized_query, query)
+            print("Résultats de la requête SQL (cache) :")
+            print_result(cached_result)
+            return statement_entry(
+                query, statement.type.name, 0.0, result=cached_result, cached=True
+            )
+
+        # Version relevée avant l'exécution : une ingestion concurrente invalide le résultat
+        version = database_version()
+        materialized = materialized_table(connection, normalized_query) if reusable else None
+        if materialized is not None:
+            print(f"Requête servie par la table matérialisée {materialized}.")
+            entry = run_statement(
+                connection, f"SELECT * FROM {materialized}", max_rows, max_bytes, timeout
+            )
+            entry["query"] = query
+            entry["materialized"] = True
+            query_log.record(normalized_query, query)
+        else:
+            entry = run_statement(connection, query, max_rows, max_bytes, timeout)
+        if entry["result"] is None:
+            return entry
+
+        tables = query_tables(query)
+        if tables is not None and reusable:
+            query_cache.put(cache_key, entry["result"], tables, version)
+        if materialized is None:
+            log_entry = query_log.record(
+                normalized_query, query, entry["elapsed_seconds"], tables
+            )
+            # Seul un résultat complet, reproductible et lu sans ingestion concurrente peut être matérialisé
+            materializable = (
+                reusable
+                and tables
+                and not entry["result"]["truncated"]
+                and database_version() == version
+                and is_hot(log_entry)
+                and is_aggregate_query(connection, query)
+            )
+            if materializable:
+                try:
+                    materialize_query(
+                        connection, normalized_query, query, tables, entry["result"]["data"], version
+                    )
+                except duckdb.Error as e:
+                    print(f"Erreur lors de la matérialisation de la requête : {e}")
+    return entry
+
+
+def run_read_statements(statements, max_rows, max_bytes, timeout):
+    """Exécute des lectures indépendantes en parallèle, chacune sur son curseur."""
+    if len(statements) <= 1 or SQL_BATCH_WORKERS <= 1:
+        return [
+            run_read_statement(statement, max_rows, max_bytes, timeout)
+            for statement in statements
+        ]
+    # Un contexte par lecture : ses spans restent rattachés au span de la suite
+    contexts = [contextvars.copy_context() for _ in statements]
+    with ThreadPoolExecutor(
+        max_workers=min(SQL_BATCH_WORKERS, len(statements)), thread_name_prefix="sql-batch"
+    ) as executor:
+        return list(
+            executor.map(
+                lambda context, statement: context.run(
+                    run_read_statement, statement, max_rows, max_bytes, timeout
+                ),
+                contexts,
+                statements,
+            )
+        )
+
+
+def run_write_statements(statements, max_rows, max_bytes, timeout):
+    """
+    Exécute dans l'ordre une suite contenant des modifications, dans une seule
+    transaction. Une suite qui gère elle-même ses transactions (BEGIN, COMMIT...)
+    est exécutée telle quelle, et une transaction laissée ouverte est annulée.
+    """
+    manages_transaction = any(
+        statement.type == duckdb.StatementType.TRANSACTION for statement in statements
+    )
+    entries = []
+    modified = set()
+    all_tables_modified = False
+    with pooled_cursor() as connection:
+        if not manages_transaction:
+            connection.begin()
+        try:
+            for statement in statements:
+                if entries and entries[-1]["error"] and not manages_transaction:
+                    entries.append(skipped_entry(statement))
+                    continue
+                entries.append(
+                    run_statement(
+                        connection,
+                        statement.query.strip(),
+                        max_rows,
+                        max_bytes,
+                        timeout,
+                        statement.type.name,
+                    )
+                )
+                tables = modified_tables(statement)
+                if manages_transaction and tables != []:
+                    # Invalide les résultats en cache qui lisent les tables modifiées
+                    bump_database_version(tables)
+                elif tables is None:
+                    all_tables_modified = True
+                else:
+                    modified.update(tables)
+        except BaseException:
+            rollback_quietly(connection)
+            raise
+
+        if manages_transaction:
+            # Le curseur retourne au pool : pas de transaction ouverte
+            rollback_quietly(connection)
+        elif any(entry["error"] for entry in entries):
+            connection.rollback()
+            mark_rolled_back(entries)
+        else:
+            try:
+                connection.commit()
+            except duckdb.Error as e:
+                rollback_quietly(connection)
+                mark_rolled_back(entries, query_error(e, "COMMIT", 0.0))
+            else:
+                if all_tables_modified:
+                    bump_database_version()
+                elif modified:
+                    bump_database_version(sorted(modified))
+    return entries
+
+
+def modified_tables(statement):
+    """
+    Retourne les tables de la base modifiées par une instruction : liste vide si
+    elle n'en modifie aucune (réglage, table temporaire...), None si elles ne
+    peuvent pas être déterminées et que toute la base doit être considérée modifiée.
+    """
+    if statement.type in NON_MODIFYING_STATEMENT_TYPES:
+        return []
+    pattern = MODIFIED_TABLE_PATTERNS.get(statement.type)
+    query = normalize_sql(statement.query)
+    match = pattern.search(query) if pattern else None
+    if match is None:
+        if statement.type == duckdb.StatementType.COPY and COPY_TO_PATTERN.match(query):
+            return []
         return None
+    if match.groupdict().get("temporary"):
+        # CREATE TEMP TABLE, DROP TEMP VIEW... : objet propre à la connexion
+        return []
+    parts = [
+        (quoted.replace('""', '"') if quoted else name)
+        for quoted, name in TABLE_NAME_PART.findall(match.group("table"))
+    ]
+    if len(parts) > 1 and parts[-2].lower() in TEMPORARY_SCHEMAS:
+        return []
+    return [parts[-1]]
 
-    finally:
-        connection.close()
 
+def skipped_entry(statement):
+    query = statement.query.strip()
+    error = {
+        "error": "skipped",
+        "message": "Not executed: an earlier statement failed and the transaction was rolled back.",
+        "query": query,
+        "elapsed_seconds": 0.0,
+    }
+    return statement_entry(query, statement.type.name, 0.0, error=error)
 
-def get_schema(con):
-    schema_info = {}
+
+def mark_rolled_back(entries, error=None):
+    """Signale les instructions réussies d'une transaction annulée, avec l'erreur qui l'a annulée."""
+    for entry in entries:
+        if entry["error"] is None:
+            entry["rolled_back"] = True
+            entry["error"] = error
+
+
+def rollback_quietly(connection):
     try:
-        table_names = con.execute("SHOW TABLES").fetchall()
-        # Récupération des colones présentes dans chaque tables
-        for table in table_names:
-            table_name = table[0]
+        connection.rollback()
+    except duckdb.Error:
+        # Aucune transaction ouverte
+        pass
 
-            columns_info = con.execute(f"PRAGMA table_info('{table_name}')").fetchall()
 
-            schema_info[table_name] = [
-                {"name": column[1], "type": column[2]} for column in columns_info
-            ]
+def query_error(exception, query, elapsed_seconds, timeout=None):
+    """
+    Construit l'erreur structurée d'une requête : type d'erreur (« timeout »,
+    « interrupted », « out_of_memory », « syntax », « binder », « catalog »,
+    « constraint » ou « execution »), message, requête et durée.
+    """
+    if isinstance(exception, duckdb.InterruptException):
+        kind = "timeout" if timeout is not None else "interrupted"
+    elif isinstance(exception, duckdb.OutOfMemoryException):
+        kind = "out_of_memory"
+    elif isinstance(exception, duckdb.ParserException):
+        kind = "syntax"
+    elif isinstance(exception, duckdb.BinderException):
+        kind = "binder"
+    elif isinstance(exception, duckdb.CatalogException):
+        kind = "catalog"
+    elif isinstance(exception, duckdb.ConstraintException):
+        kind = "constraint"
+    else:
+        kind = "execution"
+    message = str(exception)
+    if kind == "timeout":
+        message = f"Query exceeded the {timeout:g} s timeout and was interrupted."
+    return {
+        "error": kind,
+        "message": message,
+        "query": query.strip(),
+        "elapsed_seconds": round(elapsed_seconds, 3),
+    }
 
-            # Afficher le schéma pour le débogage
-            print(f"Schéma de la table '{table_name}':")
-            for column in columns_info:
-                print(f"- Colonne: {column[1]}, Type: {column[2]}")
+
+def validate_sql_query(query, con=None):
+    """
+    Valide une requête avec l'analyseur et le binder de DuckDB, sur le catalogue
+    courant et sans l'exécuter : chaque instruction est seulement préparée par
+    EXPLAIN. Les CTE, alias et identifiants entre guillemets sont résolus comme à
+    l'exécution. La validation s'arrête à la première instruction qui modifie le
+    catalogue ou les données (CREATE, INSERT...) : les suivantes peuvent lire ce
+    qu'elle crée et sont vérifiées à l'exécution. Retourne la liste des erreurs
+    structurées (voir query_error), complétées par la ligne et la position de
+    l'erreur dans l'instruction ; la liste est vide si la requête est valide.
+    """
+    con = con if con is not None else thread_cursor()
+    started = time.perf_counter()
+    try:
+        statements = con.extract_statements(query)
+    except duckdb.Error as e:
+        return [located_query_error(e, query.strip(), time.perf_counter() - started)]
+
+    errors = []
+    for statement in statements:
+        # EXPLAIN ne s'applique pas à une instruction EXPLAIN
+        if statement.type == duckdb.StatementType.EXPLAIN:
+            continue
+        statement_query = statement.query.strip()
+        started = time.perf_counter()
+        try:
+            con.execute(EXPLAIN_PREFIX + statement_query)
+        except duckdb.Error as e:
+            errors.append(
+                located_query_error(
+                    e, statement_query, time.perf_counter() - started, len(EXPLAIN_PREFIX)
+                )
+            )
+        if statement.type not in NON_MODIFYING_STATEMENT_TYPES:
+            break
+    return errors
+
+
+def located_query_error(exception, query, elapsed_seconds, prefix_length=0):
+    """
+    Construit l'erreur structurée d'une requête validée, avec la ligne (à partir
+    de 1) et la position (à partir de 0) indiquées par DuckDB, ou None. DuckDB
+    n'affiche qu'un extrait des lignes longues : la position n'est alors pas connue.
+    `prefix_length` est la longueur du préfixe ajouté à la requête, retiré du message.
+    """
+    error = query_error(exception, query, elapsed_seconds)
+    error["line"] = None
+    error["position"] = None
+    match = ERROR_CONTEXT_PATTERN.search(error["message"])
+    if match is None:
+        return error
+
+    line = int(match.group(1))
+    context = match.group(2)
+    label = f"LINE {line}: "
+    column = len(match.group(3)) - len(label)
+    if line == 1 and prefix_length and context.startswith(EXPLAIN_PREFIX):
+        context = context[prefix_length:]
+        column -= prefix_length
+    error["message"] = (
+        error["message"][:match.start()] + f"\n\n{label}{context}\n{' ' * (len(label) + column)}^"
+    )
+    error["line"] = line
+    if not context.startswith("...") and column >= 0:
+        lines = query.split("\n")
+        error["position"] = sum(len(text) + 1 for text in lines[:line - 1]) + column
+    return error
+
+
+def qualify_columns(query, schema, con=None):
+    """
+    Préfixe les colonnes non qualifiées d'une requête par la table (ou son alias)
+    qui les fournit. La requête est analysée une seule fois par DuckDB
+    (json_serialize_sql) : seules les références de colonnes sont réécrites, jamais
+    les chaînes ni les alias, et chaque colonne n'est cherchée que dans les tables
+    de la clause FROM où elle apparaît. Une colonne présente dans plusieurs de ces
+    tables, ou dont la clause FROM contient une CTE, une sous-requête ou une
+    fonction table, est laissée telle quelle. Une requête qui n'est pas une suite
+    de SELECT est retournée inchangée.
+    """
+    con = con if con is not None else thread_cursor()
+    try:
+        serialized = json.loads(
+            con.execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0]
+        )
+    except duckdb.Error:
+        return query
+    if serialized.get("error"):
+        return query
+
+    insertions = []
+    qualify_node(serialized["statements"], schema, set(), [], set(), insertions)
+    # Positions données par DuckDB en octets : insertion de la fin vers le début
+    encoded = query.encode("utf-8")
+    for location, qualifier in sorted(insertions, reverse=True):
+        encoded = encoded[:location] + qualifier.encode("utf-8") + encoded[location:]
+    return encoded.decode("utf-8")
+
+
+def qualify_node(node, schema, ctes, scope, aliases, insertions):
+    """Parcourt l'arbre sérialisé d'une requête et note les préfixes à insérer."""
+    if isinstance(node, list):
+        for item in node:
+            qualify_node(item, schema, ctes, scope, aliases, insertions)
+        return
+    if not isinstance(node, dict):
+        return
+
+    if "cte_map" in node:
+        ctes = ctes | {cte["key"].lower() for cte in node["cte_map"]["map"]}
+    if node.get("type") == "SELECT_NODE":
+        scope = from_scope(node["from_table"], schema, ctes)
+        # Un alias du SELECT masque la colonne de même nom (ORDER BY, HAVING...)
+        aliases = {
+            expression["alias"].lower()
+            for expression in node["select_list"]
+            if expression.get("alias")
+        }
+    elif node.get("class") == "COLUMN_REF" and len(node["column_names"]) == 1:
+        column = node["column_names"][0].lower()
+        location = node.get("query_location")
+        # Position absente (valeur maximale) pour une référence générée par DuckDB
+        if location is None or location >= 2 ** 63 or column in aliases:
+            return
+        if any(columns is None for _, columns in scope):
+            return
+        sources = [qualifier for qualifier, columns in scope if column in columns]
+        if len(sources) == 1:
+            insertions.append((location, quote_identifier(sources[0]) + "."))
+        return
+
+    for value in node.values():
+        qualify_node(value, schema, ctes, scope, aliases, insertions)
+
+
+def from_scope(table_ref, schema, ctes):
+    """
+    Retourne les tables d'une clause FROM sous forme de (nom ou alias, colonnes),
+    les colonnes valant None quand elles ne sont pas connues par le schéma.
+    """
+    ref_type = table_ref.get("type")
+    if ref_type == "JOIN":
+        return from_scope(table_ref["left"], schema, ctes) + from_scope(
+            table_ref["right"], schema, ctes
+        )
+    if ref_type == "EMPTY":
+        return []
+    columns = None
+    if ref_type == "BASE_TABLE":
+        table_name = table_ref["table_name"]
+        qualifier = table_ref["alias"] or table_name
+        table_columns = schema_columns(schema, table_name)
+        renamed = table_ref.get("column_name_alias")
+        if table_columns is not None and table_name.lower() not in ctes and not renamed:
+            columns = {column["name"].lower() for column in table_columns}
+        return [(qualifier, columns)]
+    return [(table_ref.get("alias") or "", None)]
+
+
+def schema_columns(schema, table_name):
+    """Colonnes d'une table du schéma ; DuckDB ignore la casse des noms de tables."""
+    if table_name in schema:
+        return schema[table_name]
+    lowered = table_name.lower()
+    return next(
+        (columns for name, columns in schema.items() if name.lower() == lowered), None
+    )
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def fetch_bounded_result(cursor, max_rows, max_bytes):
+    """
+    Lit le résultat d'une requête par lots Arrow. Seules les premières lignes sont
+    conservées, dans la limite de `max_rows` lignes et `max_bytes` octets ; les
+    suivantes sont seulement comptées, sans jamais être converties en objets Python.
+    """
+    if hasattr(cursor, "to_arrow_reader"):
+        reader = cursor.to_arrow_reader(SQL_RESULT_BATCH_ROWS)
+    else:
+        reader = cursor.fetch_record_batch(SQL_RESULT_BATCH_ROWS)
+
+    kept_batches = []
+    kept_rows = 0
+    kept_bytes = 0
+    row_count = 0
+    for batch in reader:
+        row_count += batch.num_rows
+        if kept_rows >= max_rows or kept_bytes >= max_bytes or batch.num_rows == 0:
+            continue
+        rows = min(batch.num_rows, max_rows - kept_rows)
+        # Taille moyenne d'une ligne du lot pour respecter la limite en octets
+        row_bytes = batch.nbytes / batch.num_rows
+        rows = min(rows, int((max_bytes - kept_bytes) / row_bytes) if row_bytes else rows)
+        if rows > 0:
+            batch = batch.slice(0, rows)
+            kept_batches.append(batch)
+            kept_rows += rows
+            kept_bytes += batch.nbytes
+        else:
+            kept_bytes = max_bytes
+
+    data = pa.Table.from_batches(kept_batches, schema=reader.schema)
+    return {
+        "columns": data.column_names,
+        "data": data,
+        "row_count": row_count,
+        "truncated": data.num_rows < row_count,
+    }
+
+
+def format_result(result, result_format):
+    """Convertit un résultat borné vers le format demandé : records, arrow ou dataframe."""
+    if result_format == "records":
+        return dict(result, data=result["data"].to_pylist())
+    if result_format == "arrow":
+        return dict(result)
+    if result_format == "dataframe":
+        return dict(result, data=result["data"].to_pandas())
+    raise ValueError(f"Unsupported result format: {result_format}")
+
+
+def print_result(result):
+    """Affiche le nombre de lignes d'un résultat et ses premières lignes."""
+    data = result["data"]
+    summary = f"{result['row_count']} ligne(s)"
+    if result["truncated"]:
+        summary += f", tronqué à {data.num_rows} ligne(s)"
+    print(f"{summary} : {data.slice(0, SQL_RESULT_LOG_ROWS).to_pylist()}")
+
+
+def query_cache_stats():
+    """Retourne les compteurs du cache de résultats (hits, misses, évictions, taille)."""
+    return query_cache.stats()
+
+
+def query_log_stats(limit=20):
+    """Retourne les lectures les plus demandées avec leur fréquence et leur durée moyenne."""
+    return query_log.top(limit)
+
+
+def get_schema(con):
+    """
+    Retourne le schéma des tables de données ({table: [{"name", "type"}, ...]}),
+    lu en une seule requête sur information_schema.columns. Les colonnes profilées
+    à l'ingestion portent aussi leur profil (clé « profile », voir ColumnProfiles). Le schéma est gardé en
+    mémoire et relu seulement quand la version de la base change (ingestion ou
+    instruction modifiant la base). Le dictionnaire retourné est partagé : ne pas
+    le modifier.
+    """
+    global schema_cache
+    version = database_version()
+    cached = schema_cache
+    if cached is not None and cached["version"] == version:
+        return cached["schema"]
+
+    schema_info = {}
+    try:
+        # Tables du schéma principal uniquement : le catalogue interne (_catalog) et
+        # les tables temporaires d'une ingestion en cours sont exclus
+        columns_info = con.execute(
+            "SELECT table_name, column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'main' AND NOT starts_with(table_name, ?) "
+            "ORDER BY table_name, ordinal_position",
+            [SHADOW_PREFIX],
+        ).fetchall()
+        try:
+            profiles = load_profiles(con)
+        except duckdb.CatalogException:
+            # Base sans catalogue de profils (aucune ingestion dans ce fichier)
+            profiles = {}
+        for table_name, column_name, data_type in columns_info:
+            column = {"name": column_name, "type": data_type}
+            profile = profiles.get(table_name, {}).get(column_name)
+            if profile is not None:
+                column["profile"] = profile
+            schema_info.setdefault(table_name, []).append(column)
+        print(
+            f"Schéma chargé : {len(schema_info)} table(s), {len(columns_info)} colonne(s) "
+            f"(version {version})."
+        )
+        schema_cache = {"version": version, "schema": schema_info}
 
     except Exception as e:
         print(f"Error fetching schema: {e}")
@@ -0,0 +1,276 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Traces désactivées avec TRACING_ENABLED=false
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Fichier des traces au format JSON, une ligne par span (vide : sortie standard)
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH") or None
+
+# Adresse locale de l'endpoint des métriques au format Prometheus (port 0 : désactivé)
+TRACING_METRICS_HOST = os.getenv("TRACING_METRICS_HOST", "127.0.0.1")
+TRACING_METRICS_PORT = int(os.getenv("TRACING_METRICS_PORT", 9464))
+
+# Bornes (en secondes) de l'histogramme des durées
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Attributs numériques cumulés en compteurs par étape
+COUNTED_ATTRIBUTES = ("prompt_chars", "response_chars", "rows")
+
+METRICS_PREFIX = "data_interpreter"
+
+# Span en cours dans le contexte d'exécution (thread ou tâche)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_log_lock = threading.Lock()
+
+
+class Span:
+    """Étape mesurée d'une requête : nom, durée, attributs et span parent."""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.started_at = datetime.now()
+        self.duration_seconds = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        """Termine le span, l'écrit dans les traces et l'ajoute aux métriques."""
+        if self.duration_seconds is not None:
+            return
+        self.duration_seconds = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        write_span(self)
+        metrics.observe(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(self.duration_seconds, 6),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class NullSpan:
+    """Span sans effet, utilisé quand les traces sont désactivées."""
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error=None):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def start_span(name, **attributes):
+    """
+    Démarre un span enfant du span en cours, sans le rendre courant : à terminer
+    par span.end(). Utile pour une étape qui se termine dans un générateur.
+    """
+    if not TRACING_ENABLED:
+        return NULL_SPAN
+    return Span(name, _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Mesure le bloc `with` comme un span enfant du span en cours."""
+    if not TRACING_ENABLED:
+        yield NULL_SPAN
+        return
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+@contextmanager
+def use_span(current):
+    """
+    Rend courant un span démarré par start_span, par exemple dans le thread qui
+    exécute une partie de son étape, sans le terminer à la sortie du bloc.
+    """
+    token = _current_span.set(current if isinstance(current, Span) else None)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+
+
+def current_span():
+    """Retourne le span en cours, pour lui ajouter des attributs."""
+    return _current_span.get() or NULL_SPAN
+
+
+def traced(name=None):
+    """Décorateur : chaque appel de la fonction est mesuré comme un span."""
+
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_span(finished_span):
+    """Écrit un span terminé en une ligne JSON, dans TRACE_LOG_PATH ou sur la sortie standard."""
+    line = json.dumps({"trace": finished_span.to_dict()}, default=str, ensure_ascii=False)
+    if TRACE_LOG_PATH is None:
+        print(line)
+        return
+    with _log_lock:
+        with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class SpanMetrics:
+    """Durées (histogramme), erreurs et attributs cumulés des spans, par nom d'étape."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, finished_span):
+        with self._lock:
+            stage = self._stages.get(finished_span.name)
+            if stage is None:
+                stage = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": [0] * len(self.buckets),
+                    "errors": 0,
+                    "counters": dict.fromkeys(COUNTED_ATTRIBUTES, 0),
+                }
+                self._stages[finished_span.name] = stage
+            stage["count"] += 1
+            stage["sum"] += finished_span.duration_seconds
+            for index, bound in enumerate(self.buckets):
+                if finished_span.duration_seconds <= bound:
+                    stage["buckets"][index] += 1
+            if finished_span.error:
+                stage["errors"] += 1
+            for attribute in COUNTED_ATTRIBUTES:
+                value = finished_span.attributes.get(attribute)
+                if isinstance(value, (int, float)):
+                    stage["counters"][attribute] += value
+
+    def render(self):
+        """Retourne les métriques au format texte de Prometheus."""
+        with self._lock:
+            stages = {
+                name: dict(stage, buckets=list(stage["buckets"]), counters=dict(stage["counters"]))
+                for name, stage in sorted(self._stages.items())
+            }
+        duration = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines = [
+            f"# HELP {duration} Duration of each pipeline stage.",
+            f"# TYPE {duration} histogram",
+        ]
+        for name, stage in stages.items():
+            label = escape_label(name)
+            for bound, count in zip(self.buckets, stage["buckets"]):
+                lines.append(f'{duration}_bucket{{stage="{label}",le="{bound:g}"}} {count}')
+            lines.append(f'{duration}_bucket{{stage="{label}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'{duration}_sum{{stage="{label}"}} {stage["sum"]:.6f}')
+            lines.append(f'{duration}_count{{stage="{label}"}} {stage["count"]}')
+
+        errors = f"{METRICS_PREFIX}_stage_errors_total"
+        lines += [f"# HELP {errors} Failed pipeline stages.", f"# TYPE {errors} counter"]
+        for name, stage in stages.items():
+            lines.append(f'{errors}{{stage="{escape_label(name)}"}} {stage["errors"]}')
+
+        for attribute in COUNTED_ATTRIBUTES:
+            counter = f"{METRICS_PREFIX}_{attribute}_total"
+            lines += [
+                f"# HELP {counter} Sum of the {attribute} attribute of each stage.",
+                f"# TYPE {counter} counter",
+            ]
+            for name, stage in stages.items():
+                if stage["counters"][attribute]:
+                    lines.append(
+                        f'{counter}{{stage="{escape_label(name)}"}} {stage["counters"][attribute]:g}'
+                    )
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Métriques du processus, exposées par l'endpoint local
+metrics = SpanMetrics()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Pas de ligne de log par interrogation des métriques
+        pass
+
+
+def start_metrics_server(host=TRACING_METRICS_HOST, port=TRACING_METRICS_PORT):
+    """
+    Démarre l'endpoint /metrics dans un thread d'arrière-plan et retourne le
+    serveur, ou None s'il est désactivé ou ne peut pas démarrer.
+    """
+    if not TRACING_ENABLED or not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Error starting metrics endpoint on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-endpoint", daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
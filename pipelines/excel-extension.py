@@ -1,17 +1,25 @@
 import os
+import queue
 import sys
+import threading
+import time
 import typing
-import duckdb
 from langchain_community.llms import Ollama
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from SetupDatabase import prepare_database
+from IngestionQueue import IngestionQueue
+from DataWatcher import DataWatcher, scan_data_files
 from SqlTool import get_schema
+from SchemaIndex import prune_schema
+from DatabaseConnection import close_database, thread_cursor
+from Tracing import span, start_metrics_server, start_span, traced, use_span
 from langchain_ollama import OllamaLLM
 from LlmGeneration import (
     generate_tools_with_llm,
     command_r_plus_plan,
     generate_final_response_with_llama,
+    stream_final_response_with_llama,
 )
 import io
 import uuid
@@ -56,12 +64,18 @@ class Pipeline:
         LLAMAINDEX_RAG_MODEL_NAME: str = "duckdb-nsql:latest"
         LLAMAINDEX_CONTEXT_MODEL_NAME: str = "llama3.2:latest"
         LLAMAINDEX_IMAGE_DECODER_NAME: str = "llama3.2-vision:latest"
+        INGESTION_WORKERS: int = os.cpu_count() or 1
+        SCHEMA_TOP_K: int = 8
+        SCHEMA_TOKEN_BUDGET: int = 3000
+        TRACING_METRICS_PORT: int = 9464
         # FICHIERS: str = ""
 
     def __init__(self):
         self.sql_results = None
         self.python_results = None
-        self.known_files = set()
+        self.ingestion_queue = None
+        self.data_watcher = None
+        self.metrics_server = None
         self.valves = self.Valves(
             LLAMAINDEX_OLLAMA_BASE_URL=os.getenv(
                 "LLAMAINDEX_OLLAMA_BASE_URL", "http://host.docker.internal:11434"
@@ -76,6 +90,12 @@ class Pipeline:
             LLAMAINDEX_IMAGE_DECODER_NAME=os.getenv(
                 "LLAMAINDEX_IMAGE_DECODER_NAME", "llama3.2-vision:latest"
             ),
+            INGESTION_WORKERS=int(
+                os.getenv("INGESTION_WORKERS", os.cpu_count() or 1)
+            ),
+            SCHEMA_TOP_K=int(os.getenv("SCHEMA_TOP_K", 8)),
+            SCHEMA_TOKEN_BUDGET=int(os.getenv("SCHEMA_TOKEN_BUDGET", 3000)),
+            TRACING_METRICS_PORT=int(os.getenv("TRACING_METRICS_PORT", 9464)),
             # fichiers=Valves.Files(description="Téléchargez des fichiers à traiter")
             # FICHIERS = os.getenv("FICHIERS", ""),
         )
@@ -112,60 +132,44 @@ class Pipeline:
     async def on_startup(self):
         directory = "/app/data"
         all_places_to_set = [directory]
+
+        # Durées de chaque étape au format Prometheus, sur http://127.0.0.1:<port>/metrics
+        self.metrics_server = start_metrics_server(port=self.valves.TRACING_METRICS_PORT)
+
+        # Les fichiers ajoutés, modifiés ou supprimés sont traités en arrière-plan
+        self.ingestion_queue = IngestionQueue(
+            self.image_decoder_model,
+            self.valves.INGESTION_WORKERS,
+        )
+        # La surveillance démarre avant le chargement initial pour ne manquer aucune
+        # modification ; un fichier déjà à jour est ignoré d'après le manifeste
+        self.data_watcher = DataWatcher(
+            directory, self.ingestion_queue.submit, scan_data_files(directory)
+        )
+        self.data_watcher.start()
+
         print(f"Loading files from directory: {directory}")
-        prepare_database(all_places_to_set, self.image_decoder_model, True)
-        # Mettre à jour les fichiers connus
-        self.known_files = self.scan_directory(directory)
-        print(f"Known files after startup: {self.known_files}")
-
-    def scan_directory(self, directory: str) -> set:
-        """Scanne le répertoire pour obtenir une liste des fichiers valides."""
-        return {
-            os.path.join(directory, f)
-            for f in os.listdir(directory)
-            if os.path.isfile(os.path.join(directory, f))
-            and f.endswith((".xls", ".xlsx", ".csv", ".json", ".pdf", ".py"))
-        }
-
-    def detect_and_process_changes(self, directory: str, ollama_model=None):
-        """Détecte les ajouts et suppressions de fichiers et traite uniquement les nouveaux ou supprimés."""
-        current_files = self.scan_directory(directory)
-        added_files = current_files - self.known_files
-        removed_files = self.known_files - current_files
-
-        # Traiter les fichiers ajoutés
-        if added_files:
-            print(f"New files detected: {added_files}")
-            for new_file in added_files:
-                print(f"Adding {new_file} to database.")
-                try:
-                    prepare_database([new_file], ollama_model, False)
-                except Exception as e:
-                    print(f"Error processing file {new_file}: {e}")
-
-        # Traiter les fichiers supprimés
-        if removed_files:
-            print(f"Files removed: {removed_files}")
-            conn = duckdb.connect("/app/db/my_database.duckdb")
-            for removed_file in removed_files:
-                file_prefix = os.path.splitext(os.path.basename(removed_file))[
-                    0
-                ].lower()
-                print(f"Removing data related to {file_prefix} from database.")
-                try:
-                    # Lister toutes les tables dans la base de données
-                    existing_tables = conn.execute("SHOW TABLES").fetchall()
-                    for table in existing_tables:
-                        table_name = table[0]  # Récupérer le nom de la table
-                        # Vérifier si le nom de la table commence par le préfixe du fichier
-                        if table_name.startswith(file_prefix):
-                            print(f"Dropping table: {table_name}")
-                            conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-                except Exception as e:
-                    print(f"Error removing data for {removed_file}: {e}")
-
-        # Mettre à jour la liste des fichiers connus
-        self.known_files = current_files
+        # Seuls les fichiers nouveaux ou modifiés depuis le dernier démarrage sont rechargés
+        prepare_database(
+            all_places_to_set,
+            self.image_decoder_model,
+            True,
+            self.valves.INGESTION_WORKERS,
+        )
+        self.ingestion_queue.start()
+
+    def pending_ingestion_note(self) -> str:
+        """Indique à l'utilisateur les fichiers dont l'ingestion n'est pas terminée."""
+        if self.ingestion_queue is None:
+            return ""
+        pending_files = self.ingestion_queue.pending_files()
+        if not pending_files:
+            return ""
+        return (
+            "\n\nNote : les fichiers suivants sont en cours d'ingestion et ne sont "
+            "pas encore pris en compte dans cette réponse :\n"
+            + "\n".join(f"- {os.path.basename(path)}" for path in pending_files)
+        )
 
     async def inlet(self, body: dict, user: typing.Optional[dict] = None) -> dict:
         if self.valves.LLAMAINDEX_RAG_MODEL_NAME is not None:
@@ -183,19 +187,22 @@ class Pipeline:
                 model=self.valves.LLAMAINDEX_CONTEXT_MODEL_NAME,
                 base_url="http://host.docker.internal:11434",
             )
-        directory = "/app/data"
-        # Détecter et traiter les modifications
-        self.detect_and_process_changes(directory, ollama_model=None)
-
-        # Mettre à jour la liste des fichiers connus après traitement
-        self.known_files = self.scan_directory(directory)
-        print(f"Updated known files: {self.known_files}")
+        # Les modifications du répertoire de données sont suivies par self.data_watcher :
+        # la requête est traitée avec les données déjà publiées
 
         # Extraire les fichiers du corps de la requête
         return body
 
     async def on_shutdown(self):
         print("Server shutting down...")
+        if self.data_watcher is not None:
+            self.data_watcher.stop()
+        if self.ingestion_queue is not None:
+            self.ingestion_queue.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        close_database()
 
     def verify_and_reflect(self, context, schema):
         if self.sql_results:
@@ -208,13 +215,33 @@ class Pipeline:
             return "Terminé"
         return "Continuer"
 
-    def llm_data_interpreter(self, question, schema, initial_context):
+    @traced()
+    def llm_data_interpreter(self, question, initial_context, on_progress=None, stream=False):
+        """
+        Planifie, exécute les outils puis génère la réponse finale. `on_progress`
+        reçoit un message à la fin de chaque étape ; avec `stream`, la réponse
+        finale est retournée sous forme de générateur de tokens.
+        """
+        on_progress = on_progress or (lambda message: None)
         context = initial_context
         self.python_results = None
         self.sql_results = None
-        schema = get_schema(duckdb.connect("/app/db/my_database.duckdb"))
+        with span("schema.load") as current:
+            schema = get_schema(thread_cursor())
+            current.set(tables=len(schema))
+        # Seules les tables pertinentes pour la question sont décrites aux modèles
+        with span("schema.prune") as current:
+            schema = prune_schema(
+                question,
+                schema,
+                thread_cursor(),
+                self.valves.SCHEMA_TOP_K,
+                self.valves.SCHEMA_TOKEN_BUDGET,
+            )
+            current.set(tables=len(schema))
         while True:
             plan = command_r_plus_plan(question, schema, self.contextualisation_model)
+            on_progress("Plan prêt")
             context, python_results, sql_results, files_generated = (
                 generate_tools_with_llm(
                     plan,
@@ -224,14 +251,69 @@ class Pipeline:
                     self.python_results,
                     self.database_model,
                     self.reasoning_model,
+                    on_progress,
                 )
             )
             reflection = self.verify_and_reflect(context, schema)
             break
+        if stream:
+            return stream_final_response_with_llama(
+                context, sql_results, python_results, self.reasoning_model, files_generated
+            )
         return generate_final_response_with_llama(
             context, sql_results, python_results, self.reasoning_model, files_generated
         )
 
+    def stream_data_interpreter(self, question, initial_context):
+        """
+        Produit au fil de l'eau les messages de progression de chaque étape, puis
+        les tokens de la réponse finale. Les étapes tournent dans un thread dont
+        les messages sont transmis par une file.
+        """
+        events = queue.Queue()
+        started = time.perf_counter()
+        # Span de toute la requête, parent des étapes exécutées dans le thread
+        request_span = start_span("request", question_chars=len(question))
+
+        def on_progress(message):
+            events.put(("progress", f"{message} ({time.perf_counter() - started:.1f} s)"))
+
+        def run():
+            try:
+                with use_span(request_span):
+                    events.put(
+                        (
+                            "response",
+                            self.llm_data_interpreter(
+                                question, initial_context, on_progress, stream=True
+                            ),
+                        )
+                    )
+            except Exception as e:
+                events.put(("error", e))
+
+        threading.Thread(target=run, name="data-interpreter", daemon=True).start()
+        error = None
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == "progress":
+                    yield f"> {value}\n\n"
+                elif kind == "error":
+                    raise value
+                else:
+                    yield from value
+                    break
+            yield self.pending_ingestion_note()
+        except Exception as e:
+            # Une partie de la réponse est déjà envoyée : l'erreur est ajoutée au flux
+            print(f"Error executing request: {str(e)}")
+            error = e
+            yield f"\n\nErreur lors du traitement de la requête : {e}"
+        finally:
+            # Le span est terminé une seule fois, avec l'erreur éventuelle
+            request_span.end(error)
+
     def pipe(
         self,
         user_message: str,
@@ -240,9 +322,9 @@ class Pipeline:
         body: dict = None,
     ) -> typing.Union[str, typing.Generator, typing.Iterator]:
         try:
-            schema = get_schema(duckdb.connect("/app/db/my_database.duckdb"))
             initial_context = {"question": user_message}
-            return self.llm_data_interpreter(user_message, schema, initial_context)
+            # Messages de progression puis tokens de la réponse, envoyés dès qu'ils sont prêts
+            return self.stream_data_interpreter(user_message, initial_context)
         except Exception as e:
             print(f"Error executing request: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))